@@ -0,0 +1,158 @@
+"""
+Text that is hard to lay out, to check layout() takes linear time.
+
+For each kind of text, lays out one of size characters, and one
+factor times bigger, and fails if that takes much more than factor
+times as long.
+
+Usage:
+    adversarial [--size=<N>] [--factor=<F>] [--case=<name>]...
+    adversarial --list
+
+Options:
+    --size=<N>          Characters in the smaller text [default: 20000]
+    --factor=<F>        How much bigger the bigger text is [default: 4]
+    --case=<name>       Only try this kind of text (see --list)
+    --list              List the kinds of text
+"""
+
+import time
+
+from boxes import Box, create_pages, layout
+from fonts import adjust_widths_by_letter
+from hyphen import insert_soft_hyphens
+from items import create_items
+
+from docopt import docopt
+
+
+def unbreakable(size):
+    """One word, with no spaces or hyphens: an endless row."""
+    return 'x' * size
+
+
+def late_unbreakable(size):
+    """A few words, and then one that never ends."""
+    return 'a row that starts well ' + 'x' * size
+
+
+def spaces(size):
+    """Words with long runs of spaces between them."""
+    run = ' ' * 1000 + 'word'
+    return run * (size // len(run))
+
+
+def newlines(size):
+    """Nothing but empty lines."""
+    return '\n' * size
+
+
+def syllables(size):
+    """One long word that can be hyphenated all along.
+
+    text_boxes() doesn't hyphenate, so the soft hyphens are already in
+    it, as create_text_boxes() would insert them.
+    """
+    word = insert_soft_hyphens('hyphenation')
+    return '\xad'.join([word] * (size // len(word)))
+
+
+def mixed(size):
+    """All of the above, one after the other."""
+    part = size // 5
+    return (
+        unbreakable(part)
+        + ' '
+        + spaces(part)
+        + newlines(part)
+        + syllables(part)
+        + ' short words' * (part // 12)
+    )
+
+
+CASES = {
+    'unbreakable': unbreakable,
+    'late-unbreakable': late_unbreakable,
+    'spaces': spaces,
+    'newlines': newlines,
+    'syllables': syllables,
+    'mixed': mixed,
+}
+
+# How each kind of text is laid out: layout() arguments, and whether
+# it gets items instead of boxes.
+MODES = {
+    'greedy': dict(algorithm='greedy'),
+    'lookback': dict(algorithm='greedy', lookback=4),
+    'total-fit': dict(algorithm='total-fit'),
+    'items': dict(items=True),
+}
+
+
+def text_boxes(text):
+    """A box per letter of text, without hyphenating it.
+
+    create_text_boxes() hyphenates, which also turns runs of spaces
+    into one. Here they stay, as anyone calling layout() could pass.
+    """
+    boxes = [Box(letter=l, stretchy=l == ' ') for l in text]
+    if boxes:
+        adjust_widths_by_letter(boxes)
+    return boxes
+
+
+def time_layout(text, items=False, repeat=3, **kwargs):
+    """The fastest of repeat layouts of text, in seconds.
+
+    Only layout() is timed, not creating the boxes.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        boxes = create_items(text) if items else text_boxes(text)
+        pages = create_pages((30, 50))
+        start = time.perf_counter()
+        layout(boxes, pages, 0.05, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(cases=None, size=20000, factor=4):
+    """Lay out each case with each mode, at size and factor * size.
+
+    Returns a list of (case, mode, small time, big time, ratio).
+    Linear time gives a ratio close to factor.
+    """
+    results = []
+    for name in cases or CASES:
+        small, big = CASES[name](size), CASES[name](size * factor)
+        for mode, kwargs in MODES.items():
+            t_small = time_layout(small, **kwargs)
+            t_big = time_layout(big, **kwargs)
+            results.append(
+                (name, mode, t_small, t_big, t_big / max(t_small, 1e-6))
+            )
+    return results
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    if arguments['--list']:
+        for name, case in CASES.items():
+            print('%-18s%s' % (name, case.__doc__))
+    else:
+        factor = int(arguments['--factor'])
+        results = benchmark(
+            arguments['--case'], int(arguments['--size']), factor
+        )
+        slow = []
+        for name, mode, t_small, t_big, ratio in results:
+            print(
+                '%-18s%-10s%8.3fs %8.3fs  x%.1f'
+                % (name, mode, t_small, t_big, ratio)
+            )
+            # Quadratic time would give factor ** 2. Twice linear
+            # leaves room for noise.
+            if ratio > 2 * factor:
+                slow.append((name, mode))
+        assert not slow, 'Not linear: %s' % slow
+        print('All linear')
@@ -0,0 +1,215 @@
+"""Lots of boxes, stored as arrays instead of one object per box."""
+
+import numpy as np
+
+# What each bit in BoxArray.flags means
+STRETCHY = 1
+NEWLINE = 2
+SOFT_HYPHEN = 4
+
+
+class BoxArray():
+    """A list of boxes, stored as one array per attribute.
+
+    A Box object takes a few hundred bytes. Here a box takes 37.
+
+    Indexing it gives BoxView objects, which can be used just like a
+    Box, so layout() and draw_boxes() work on it. Slicing it gives a
+    BoxArray that shares its arrays.
+    """
+
+    def __init__(self, size=0):
+        self.x = np.zeros(size)
+        self.y = np.zeros(size)
+        self.w = np.ones(size)
+        self.h = np.ones(size)
+        self.flags = np.zeros(size, np.uint8)
+        self.codepoints = np.zeros(size, np.uint32)
+        self.size = size
+
+    @classmethod
+    def from_text(cls, text):
+        """One box per letter of text, spaces are stretchy."""
+        boxes = cls()
+        codepoints = np.frombuffer(
+            text.encode('utf-32-le'), np.uint32
+        ).copy()
+        boxes._set_arrays(
+            x=np.zeros(len(codepoints)),
+            y=np.zeros(len(codepoints)),
+            w=np.ones(len(codepoints)),
+            h=np.ones(len(codepoints)),
+            flags=letter_flags(codepoints),
+            codepoints=codepoints,
+        )
+        return boxes
+
+    @classmethod
+    def from_advances(cls, text, advances):
+        """Like from_text, but with the widths given by advances."""
+        boxes = cls.from_text(text)
+        boxes.w[:] = advances
+        return boxes
+
+    def _set_arrays(self, **arrays):
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.size = len(self.codepoints)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self.size)
+            part = BoxArray()
+            part._set_arrays(
+                **{
+                    name: getattr(self, name)[start:stop:step]
+                    for name in FIELDS
+                }
+            )
+            return part
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError('BoxArray index out of range')
+        return BoxView(self, i)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield BoxView(self, i)
+
+    def reserve(self, extra):
+        """Make room for extra more boxes, so appending them is cheap."""
+        capacity = self.size + extra
+        if capacity <= len(self.codepoints):
+            return
+        for name in FIELDS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def append(self, box):
+        """Add a box at the end, copying its attributes."""
+        if self.size == len(self.codepoints):
+            # Grow the arrays by an eighth, like a list does, so appends
+            # are cheap without doubling a big text's memory
+            self.reserve(self.size // 8 + 16)
+        view = BoxView(self, self.size)
+        self.size += 1
+        view.x, view.y, view.w, view.h = box.x, box.y, box.w, box.h
+        view.letter = box.letter
+        view.stretchy = box.stretchy
+
+    def append_letter(self, letter, x, y, w, h=1):
+        """Add a box for letter, like Box(x, y, w, h, letter=letter)."""
+        self.append(_Letter(x, y, w, h, letter))
+
+    def extend(self, boxes):
+        """Add boxes at the end, growing the arrays only once."""
+        boxes = list(boxes)
+        self.reserve(len(boxes))
+        for box in boxes:
+            self.append(box)
+
+    def nbytes(self):
+        """How much memory the boxes take."""
+        return sum(
+            getattr(self, name)[: self.size].nbytes for name in FIELDS
+        )
+
+
+FIELDS = ('x', 'y', 'w', 'h', 'flags', 'codepoints')
+
+
+class _Letter():
+    """The attributes of a box, to append it to a BoxArray."""
+
+    def __init__(self, x, y, w, h, letter, stretchy=False):
+        self.x, self.y, self.w, self.h = x, y, w, h
+        self.letter = letter
+        self.stretchy = stretchy
+
+
+def letter_flags(codepoints):
+    """Flags for boxes with these letters, spaces are stretchy."""
+    return (
+        (codepoints == ord(' ')) * STRETCHY
+        | (codepoints == ord('\n')) * NEWLINE
+        | (codepoints == ord('\xad')) * SOFT_HYPHEN
+    ).astype(np.uint8)
+
+
+class BoxView():
+    """One box in a BoxArray, that looks just like a Box."""
+
+    __slots__ = ('boxes', 'i')
+
+    def __init__(self, boxes, i):
+        self.boxes = boxes
+        self.i = i
+
+    @property
+    def x(self):
+        return self.boxes.x.item(self.i)
+
+    @x.setter
+    def x(self, value):
+        self.boxes.x[self.i] = value
+
+    @property
+    def y(self):
+        return self.boxes.y.item(self.i)
+
+    @y.setter
+    def y(self, value):
+        self.boxes.y[self.i] = value
+
+    @property
+    def w(self):
+        return self.boxes.w.item(self.i)
+
+    @w.setter
+    def w(self, value):
+        self.boxes.w[self.i] = value
+
+    @property
+    def h(self):
+        return self.boxes.h.item(self.i)
+
+    @h.setter
+    def h(self, value):
+        self.boxes.h[self.i] = value
+
+    @property
+    def stretchy(self):
+        return bool(self.boxes.flags.item(self.i) & STRETCHY)
+
+    @stretchy.setter
+    def stretchy(self, value):
+        if value:
+            self.boxes.flags[self.i] |= STRETCHY
+        else:
+            self.boxes.flags[self.i] &= ~STRETCHY & 0xFF
+
+    @property
+    def letter(self):
+        return chr(self.boxes.codepoints.item(self.i))
+
+    @letter.setter
+    def letter(self, value):
+        codepoint = ord(value)
+        flags = self.boxes.flags.item(self.i) & STRETCHY
+        if value == '\n':
+            flags |= NEWLINE
+        elif value == '\xad':
+            flags |= SOFT_HYPHEN
+        self.boxes.codepoints[self.i] = codepoint
+        self.boxes.flags[self.i] = flags
+
+    def __repr__(self):
+        return 'Box(%s, %s, %s, %s, "%s")' % (
+            self.x, self.y, self.w, self.y, self.letter
+        )
@@ -1,11 +1,76 @@
 """
 Usage:
     boxes <input> <output> [--page-size=<WxH>] [--separation=<sep>]
+          [--algorithm=<alg>] [--lookback=<K>] [--jobs=<N>]
+          [--pagination=<alg>] [--columns=<N>] [--column-gap=<gap>]
+          [--box-array] [--backend=<name>]
+          [--pages=<range>] [--max-pages=<N>] [--checkpoints]
+          [--marks] [--index] [--validate] [--cache=<dir>]
+    boxes --stats <input> [--page-size=<WxH>] [--separation=<sep>]
+    boxes --estimate <input> [--page-size=<WxH>] [--separation=<sep>]
+    boxes --copyfit=<pages> <input> [--fit=<what>] [--low=<v>] [--high=<v>]
+          [--page-size=<WxH>] [--separation=<sep>]
+    boxes --out-of-core=<dir> <input> <output> [--page-size=<WxH>]
+          [--separation=<sep>] [--algorithm=<alg>] [--lookback=<K>]
+          [--pages=<range>] [--max-pages=<N>]
     boxes --version
+
+Options:
+    --stats             Print page and row counts as JSON, without
+                        drawing anything
+    --estimate          Print an estimate of the page count as JSON,
+                        laying out only a sample of paragraphs
+    --copyfit=<pages>   Find the page width, page height or separation
+                        that lays out the text in that many pages
+    --fit=<what>        What to change: width, height or separation
+                        [default: width]
+    --low=<v>           The smallest value to try
+    --high=<v>          The largest value to try
+    --out-of-core=<dir>
+                        Lay out keeping the boxes in files in <dir>,
+                        not in memory, and print the peak memory used.
+                        Only --pages are drawn, or the first page
+    --algorithm=<alg>   How to break rows: greedy or total-fit
+                        [default: greedy]
+    --lookback=<K>      Greedy breaks at the best of the last K places
+                        where a row can break [default: 1]
+    --jobs=<N>          Break paragraphs into rows using N processes
+    --pagination=<alg>  How to break pages: greedy or optimal
+                        [default: greedy]
+    --columns=<N>       Split pages in N columns, balancing the last
+                        page's columns [default: 1]
+    --column-gap=<gap>  Space between columns [default: 1]
+    --box-array         Store boxes in arrays, using less memory
+    --backend=<name>    Lay out using python, numpy or items. numpy
+                        only does greedy layout, in arrays. items does
+                        the same greedy layout, of words, glue and
+                        penalties instead of letters [default: python]
+    --pages=<range>     Only lay out and draw these pages, like 3-5
+    --max-pages=<N>     Only lay out and draw the first N pages
+    --checkpoints       With --pages, remember where pages start in
+                        <output>.checkpoints, to start there next time
+    --marks             The input has marks for a table of contents and
+                        page references (see references.py)
+    --index             Save a search index of the words in
+                        <output>.index
+    --validate          Check that boxes don't overlap and are inside
+                        pages, and print a report
+    --cache=<dir>       Reuse the rows of paragraphs laid out before,
+                        saved in <dir>, and save new ones there
 """
 
-from fonts import adjust_widths_by_letter
+import json
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from boxarray import BoxArray
+from fonts import adjust_widths_by_letter, advances, default_context, preload
 from hyphen import insert_soft_hyphens
+from items import Item, Word, create_items, layout_items
+from numpy_layout import break_arrays
+from search import IndexWriter
+from spatial import validate
 
 import svgwrite
 from docopt import docopt
@@ -28,9 +93,10 @@ class Box():
         )
 
 
-def hyphenbox():
+def hyphenbox(context=None):
+    """A hyphen, as wide as the font (see fonts.FontContext) says."""
     b = Box(letter='-')
-    adjust_widths_by_letter([b])
+    b.w = (context or default_context()).advance('-')
     return b
 
 
@@ -42,10 +108,19 @@ def badness(page_width, row):
     # Yes, this is suboptimal. It's easier to optimize working code
     # than fixing fast code.
     row_width = (row[-1].x + row[-1].w) - row[0].x
-    slack = page_width - row_width
     stretchies = [b for b in row if b.stretchy]
-    if len(stretchies) > 0:
-        stretchies_width = sum(s.w for s in stretchies)
+    return row_badness(
+        page_width,
+        row_width,
+        len(stretchies),
+        sum(s.w for s in stretchies),
+    )
+
+
+def row_badness(page_width, row_width, stretchy_count, stretchies_width):
+    """Calculate badness() out of a row's measurements."""
+    slack = page_width - row_width
+    if stretchy_count > 0:
         # More stetchy space is good. More slack is bad.
         badness = slack / stretchies_width
     else:  # Nothing to stretch. Not good.
@@ -56,7 +131,282 @@ def badness(page_width, row):
     return badness
 
 
-def layout(_boxes, pages, separation):
+class BadnessIndex():
+    """Running totals over a list of boxes, to measure rows quickly.
+
+    Measuring a row by looking at its boxes takes time proportional to
+    its length. With these totals it takes the same time for any row.
+    """
+
+    def __init__(self, boxes, separation, context=None):
+        self.boxes = boxes
+        self.separation = separation
+        self.hyphen_width = hyphenbox(context).w
+        n = len(boxes)
+        # Running totals of width, stretchy width and stretchy count up
+        # to (not including) each box. Newlines are 0-wide when laid out.
+        # No row goes past a newline, so the totals start again after
+        # each one. Otherwise rounding errors add up along the whole
+        # text, and a paragraph measures differently than when it's
+        # laid out on its own (see break_paragraphs).
+        self.widths = widths = [0] * (n + 1)
+        self.stretch = stretch = [0] * (n + 1)
+        self.count = count = [0] * (n + 1)
+        # Index of the last box before each box that is not a space
+        self.last_word = last_word = [-1] * (n + 1)
+        for i, b in enumerate(boxes):
+            if b.letter == '\n':
+                last_word[i + 1] = i
+                continue
+            w = b.w
+            widths[i + 1] = widths[i] + w
+            stretch[i + 1] = stretch[i] + (w if b.stretchy else 0)
+            count[i + 1] = count[i] + (1 if b.stretchy else 0)
+            last_word[i + 1] = last_word[i] if b.letter == ' ' else i
+        # Index of the first box starting at each box that is not a space
+        self.first_word = first_word = [n] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            first_word[i] = (
+                first_word[i + 1] if boxes[i].letter == ' ' else i
+            )
+
+    def measure(self, i, j):
+        """Measure the row starting at box i, broken at box j.
+
+        This is the row as layout() will build it: with leading spaces
+        collapsed, trailing spaces removed and a hyphen if needed.
+
+        Returns the row's width, and the count and total width of
+        its stretchy boxes.
+        """
+        boxes = self.boxes
+        separation = self.separation
+        start, offset = i, 0
+        if i > 0 and boxes[i].letter == ' ':
+            # Collapsed spaces are 0-wide, but keep their separation
+            start, offset = self.first_word[i], separation
+        if j < len(boxes) and boxes[j].letter == '\xad':
+            end, extra = j - 1, separation + self.hyphen_width
+        else:
+            end, extra = self.last_word[j], 0
+        if end < start:  # Only spaces
+            return 0, 0, 0
+        if boxes[start].letter == '\n':
+            # The totals started again after it
+            width = count = stretch = 0
+        else:
+            width = self.widths[start]
+            count = self.count[start]
+            stretch = self.stretch[start]
+        return (
+            offset
+            + self.widths[end + 1]
+            - width
+            + separation * (end - start)
+            + extra,
+            self.count[end + 1] - count,
+            self.stretch[end + 1] - stretch,
+        )
+
+    def badness(self, i, j, page_width):
+        """The badness() of the row starting at box i, broken at box j."""
+        return row_badness(page_width, *self.measure(i, j))
+
+
+def total_fit_breaks(boxes, page_width, separation, context=None):
+    """Choose where to break rows looking at whole paragraphs.
+
+    Instead of breaking as soon as we reach the right margin, find the
+    breaks that make the sum of the squared badness of all rows in the
+    paragraph as small as possible.
+
+    Returns the set of indexes of the boxes that start a new row
+    (not counting newlines, which always do).
+    """
+    index = BadnessIndex(boxes, separation, context)
+    n = len(boxes)
+    breaks = set()
+    # For each possible break: (total demerits, previous break)
+    best = {0: (0, None)}
+    # Breaks that can still start a row that fits
+    active = [0]
+    for b in range(1, n + 1):
+        forced = b == n or boxes[b].letter == '\n'
+        if not forced and boxes[b].letter not in (' ', '\xad'):
+            continue
+        if not forced and boxes[b - 1].letter == boxes[b].letter == ' ':
+            # Breaking anywhere in a run of spaces gives the same rows,
+            # so we only look at its first space. Otherwise long runs
+            # of spaces, which never fill a row, take quadratic time.
+            continue
+        candidate = None
+        fallback = None
+        for a in active[:]:
+            row_width, stretchy_count, stretchies_width = index.measure(
+                a, b
+            )
+            if row_width > page_width:
+                # Longer rows starting at a won't fit either
+                active.remove(a)
+                demerits = (
+                    best[a][0]
+                    + row_badness(
+                        page_width,
+                        row_width,
+                        stretchy_count,
+                        stretchies_width,
+                    ) ** 2
+                )
+                if fallback is None or demerits < fallback[0]:
+                    fallback = (demerits, a)
+                continue
+            if forced:
+                # The last row of a paragraph is not justified
+                demerits = best[a][0]
+            else:
+                demerits = (
+                    best[a][0]
+                    + row_badness(
+                        page_width,
+                        row_width,
+                        stretchy_count,
+                        stretchies_width,
+                    ) ** 2
+                )
+            if candidate is None or demerits < candidate[0]:
+                candidate = (demerits, a)
+        if candidate is None:
+            # Nothing fits, so we use the least bad overfull row
+            candidate = fallback
+        if candidate is None:
+            continue
+        best[b] = candidate
+        if forced:
+            # Walk back to the start of the paragraph, remembering breaks
+            a = candidate[1]
+            while best[a][1] is not None:
+                breaks.add(a)
+                a = best[a][1]
+            # And start a new paragraph
+            best = {b: (0, None)}
+            active = [b]
+        else:
+            active.append(b)
+    return breaks
+
+
+class Row():
+    """A row of laid out boxes.
+
+    The row is made of boxes[start:end], and a hyphen box if it was
+    broken at a soft hyphen.
+    """
+
+    def __init__(self, start, end=None, hyphen=None):
+        self.start = start
+        self.end = end
+        self.hyphen = hyphen
+
+    def __repr__(self):
+        return 'Row(%s, %s, %s)' % (self.start, self.end, self.hyphen)
+
+
+class PageFrames():
+    """Put rows one below the other, going to the next page when full.
+
+    Like break_paragraphs() and paginate() do, each row is laid out
+    starting at x=0, and moved to its page once it's done. Adding the
+    page's x first would round differently, and the results must be
+    the same with or without jobs.
+
+    If index is given (see search.IndexWriter), each row is added to
+    it when it's done.
+    """
+
+    def __init__(self, boxes, pages, separation, index=None):
+        self.boxes = boxes
+        self.pages = pages
+        self.separation = separation
+        self.page = 0
+        self.index = index
+        self.row_start = 0
+
+    def first(self, i, box):
+        """Put the first box, and return where its row goes."""
+        page = self.pages[self.page]
+        box.x = 0
+        box.y = page.y
+        self.frame = Box(0, page.y, page.w, page.h)
+        return self.frame
+
+    def next(self, i, box, previous, hyphen):
+        """Start a new row with box, and return where it goes."""
+        self.finish(i, hyphen)
+        self.row_start = i
+        page = self.pages[self.page]
+        # We go all the way left and a little down
+        box.x = 0
+        box.y = previous.y + previous.h + self.separation
+
+        # But if we go too far down
+        if box.y + box.h > page.y + page.h:
+            # We go to the next page
+            self.page += 1
+            page = self.pages[self.page]
+            self.frame = Box(0, page.y, page.w, page.h)
+            # And put the box at the top-left
+            box.y = page.y
+        return self.frame
+
+    def finish(self, end, hyphen=None):
+        """The row ends before box end, and it's laid out."""
+        # Move the row to its page
+        x = self.pages[self.page].x
+        if x:
+            boxes = self.boxes
+            for i in range(self.row_start, end):
+                boxes[i].x += x
+            if hyphen is not None:
+                hyphen.x += x
+        if self.index is not None:
+            self.index.add_row(self.row_start, end, self.page)
+
+
+class RowFrames():
+    """Put rows on an endless page of the given width.
+
+    Every row starts at (0, 0), and we remember them in self.rows,
+    so they can be put on pages later.
+    """
+
+    def __init__(self, width):
+        self.frame = Box(0, 0, width, float('inf'))
+        self.rows = []
+
+    def first(self, i, box):
+        box.x = box.y = 0
+        self.rows.append(Row(i))
+        return self.frame
+
+    def next(self, i, box, previous, hyphen):
+        self.rows[-1].end = i
+        self.rows[-1].hyphen = hyphen
+        box.x = box.y = 0
+        self.rows.append(Row(i))
+        return self.frame
+
+
+def layout(
+    _boxes,
+    pages,
+    separation,
+    algorithm='greedy',
+    lookback=1,
+    jobs=None,
+    pagination='greedy',
+    index=None,
+    context=None,
+):
     """Layout boxes along pages.
 
     Keep in mind that this function modifies the boxes themselves, so
@@ -64,20 +414,186 @@ def layout(_boxes, pages, separation):
     on the same boxes.
 
     Specifically, some spaces will become 0-width and not stretchy.
+    To lay out the same text many times, use sweep.shape_text() and
+    numpy_layout.break_arrays(), which don't modify anything.
+
+    The boxes are visited once, in order, so the time this takes
+    grows linearly with the number of boxes.
+
+    algorithm decides where to break rows:
+
+    * 'greedy' breaks as soon as a row reaches the right margin.
+      If lookback is more than 1, instead of breaking right there it
+      breaks at the least bad of the last lookback places where the
+      row could be broken.
+
+      Rows break at the first space or soft hyphen past the margin, so
+      a row's last word sticks out, and its spaces are squeezed. If it
+      sticks out further than they are wide, the row is broken before
+      that word (see place_rows). That changed the output for ordinary
+      prose too, not only for text without spaces: on narrow pages,
+      where rows have few spaces, long words often stick out that far.
+      Such rows now end a word earlier than they used to, and text
+      can take more pages (pride-and-prejudice.txt on 10x20 pages
+      takes 13 or 14 instead of 12, depending on the font).
+    * 'total-fit' looks at whole paragraphs and chooses the breaks that
+      give the best spacing (see total_fit_breaks). It needs all pages
+      to be as wide as the first one.
+
+    If jobs is given, all pages must be as wide as the first one. Then
+    paragraphs are broken into rows by that many processes, and the rows
+    are put on pages afterwards (see break_paragraphs and paginate).
+    The result is the same as without jobs, for any number of jobs.
+
+    pagination decides where to break pages:
+
+    * 'greedy' goes to the next page when a row doesn't fit.
+    * 'optimal' looks at all rows and chooses the breaks that leave
+      pages most even, avoiding widows and orphans (see
+      optimal_page_breaks). Like jobs, it needs all pages to be as wide
+      as the first one.
+
+    If index is given (see search.IndexWriter), each row is added to it
+    as soon as it's laid out.
+
+    context is the fonts.FontContext that hyphens are measured with.
+
+    Instead of boxes, this also takes the words, glue and penalties
+    from items.create_items(), which only do greedy layout (see
+    items.layout_items).
     """
 
-    # Because we modify the box list, we will work on a copy
-    boxes = _boxes[:]
-    # We start at page 0
-    page = 0
+    if not _boxes:
+        return
+    if isinstance(_boxes[0], Item):
+        if (algorithm, lookback, jobs, pagination) != (
+            'greedy',
+            1,
+            None,
+            'greedy',
+        ) or index is not None:
+            raise ValueError('Items only do greedy layout')
+        page = layout_items(_boxes, pages, separation, context)
+        # Remove leftover boxes
+        del (pages[page:])
+        return
+    if pagination not in ('greedy', 'optimal'):
+        raise ValueError('Unknown pagination: %s' % pagination)
+    if pagination == 'optimal' and jobs is None:
+        # We need all rows before we can put them on pages
+        jobs = 1
+    if jobs is not None:
+        rows = break_paragraphs(
+            _boxes,
+            pages[0].w,
+            separation,
+            algorithm,
+            lookback,
+            jobs,
+            context,
+        )
+        if pagination == 'optimal':
+            breaks = optimal_page_breaks(_boxes, rows, pages, separation)
+        else:
+            breaks = None
+        positions = paginate(
+            _boxes, rows, pages, separation, breaks=breaks
+        )
+        page = positions[-1][0]
+        if index is not None:
+            for row, (row_page, y) in zip(rows, positions):
+                index.add_row(row.start, row.end, row_page)
+        _boxes.extend(row.hyphen for row in rows if row.hyphen)
+    else:
+        frames = PageFrames(_boxes, pages, separation, index)
+        hyphens = place_rows(
+            _boxes, frames, separation, algorithm, lookback, context=context
+        )
+        frames.finish(len(_boxes))
+        _boxes.extend(hyphens)
+        page = frames.page
+    # Remove leftover boxes
+    del (pages[page:])
+
+
+def place_rows(
+    boxes,
+    frames,
+    separation,
+    algorithm='greedy',
+    lookback=1,
+    continues=False,
+    context=None,
+    breaks=None,
+):
+    """Place boxes in rows, asking frames where each row goes.
+
+    If continues is True, the boxes continue an earlier layout, and the
+    first one (usually a newline) starts a new row.
+
+    If breaks is given, it's the set of indexes of the boxes that start
+    rows, as chosen by an earlier call, and algorithm is not used.
+
+    A row that can't be broken where it reaches the right margin
+    usually goes on until it can. But if it goes past the margin by
+    more than its spaces are wide, squeezing them can't make it fit
+    (see justify_row), so it's broken anyway (an emergency break): at
+    the last place where it could be broken, or right there if there's
+    none. So text without spaces doesn't make endless rows.
+
+    Returns the hyphen boxes that had to be added.
+    """
     # The 1st box should be placed in the correct page
-    previous = boxes.pop(0)
-    previous.x = pages[page].x
-    previous.y = pages[page].y
+    previous = boxes[0]
+    frame = frames.first(0, previous)
+
+    if breaks is not None:
+        pass
+    elif algorithm == 'total-fit':
+        breaks = total_fit_breaks(boxes, frame.w, separation, context)
+    elif algorithm != 'greedy':
+        raise ValueError('Unknown algorithm: %s' % algorithm)
+    if breaks is None and lookback > 1:
+        index = BadnessIndex(boxes, separation, context)
+    else:
+        index = None
+    hyphens = []
+    hyphen_width = hyphenbox(context).w
+
     row = []
-    while boxes:
-        # We take the new 1st box
-        box = boxes.pop(0)
+    # Instead of looking at the whole row over and over, we keep track
+    # of what we need to know about it as we go:
+    # Are all the boxes in the row spaces?
+    leading = True
+    # Which boxes in the row are stretchy?
+    stretchies = []
+    # Where does the row start, and where could we break it?
+    row_start = 0
+    opportunities = deque(maxlen=lookback - 1)
+    # Which box is row[0]? Without continues, the 1st box is not in
+    # any row, so it's the 2nd one.
+    row_first = 0 if continues else 1
+    # Where could we break the row last, if it comes to an emergency?
+    last_break = None
+    # And how wide are its spaces, once it's past the margin?
+    room = None
+    if continues:
+        # The 1st box starts a row like any other
+        if previous.letter == '\n':
+            previous.w = 0
+            previous.stretchy = False
+        row.append(previous)
+        leading = previous.letter == ' '
+        if leading:
+            previous.w = 0
+            previous.stretchy = False
+        elif previous.stretchy:
+            stretchies.append(previous)
+    # We walk the boxes with an index, so we can go back a little
+    # if we decide to break earlier in the row.
+    i = 1
+    while i < len(boxes):
+        box = boxes[i]
         # And put it next to the other
         box.x = previous.x + previous.w + separation
         # At the same vertical location
@@ -85,6 +601,24 @@ def layout(_boxes, pages, separation):
 
         # Handle breaking on newlines
         break_line = False
+        h_b = None
+        # Or an emergency break
+        emergency = False
+        if (
+            box.x + box.w > frame.x + frame.w
+            and not leading
+            and box.letter not in (' ', '\n')
+        ):
+            if room is None:
+                # The row only gets spaces until it's broken
+                room = sum(b.w for b in stretchies)
+            # A row broken at a soft hyphen ends with a hyphen
+            right = box.x + (
+                hyphen_width if box.letter == '\xad' else box.w
+            )
+            # (squeezing spaces to nothing is fine, even if rounding
+            # makes it a little less than nothing)
+            emergency = right > frame.x + frame.w + room + 1e-6
         # But if it's a newline
         if (box.letter == '\n'):
             break_line = True
@@ -94,70 +628,358 @@ def layout(_boxes, pages, separation):
 
         # Or if it's too far to the right, and is a
         # good place to break the line...
-        elif (box.x + box.w) > (
-            pages[page].x + pages[page].w
-        ) and box.letter in (
-            ' ', '\xad'
-        ):
+        # (or if we already decided to break here)
+        elif (
+            (box.x + box.w) > (frame.x + frame.w)
+            and box.letter in (' ', '\xad')
+            if breaks is None
+            else i in breaks
+        ) or emergency:
+            best = i
+            if emergency:
+                if last_break is not None:
+                    best = last_break
+            elif index is not None:
+                # Maybe breaking a little earlier looks better
+                best = min(
+                    list(opportunities) + [i],
+                    key=lambda j: abs(
+                        index.badness(row_start, j, frame.w)
+                    ),
+                )
+            if best != i:
+                # Take the boxes after it out of the row...
+                for b in row[best - row_first:]:
+                    if b.stretchy:
+                        stretchies.pop()
+                del row[best - row_first:]
+                # and break there instead.
+                i = best
+                box = boxes[i]
+                previous = boxes[i - 1]
+                box.x = previous.x + previous.w + separation
+                box.y = previous.y
             if box.letter == '\xad':
                 # Add a visible hyphen in the row
-                h_b = hyphenbox()
+                h_b = hyphenbox(context)
                 h_b.x = previous.x + previous.w + separation
                 h_b.y = previous.y
-                _boxes.append(h_b)  # So it's drawn
+                hyphens.append(h_b)  # So it's drawn
                 row.append(h_b)  # So it's justified
             break_line = True
             # We adjust the row
             # Remove all right-margin spaces
             while row[-1].letter == ' ':
-                row.pop()
-            slack = (pages[page].x + pages[page].w) - (
-                row[-1].x + row[-1].w
-            )
-            # Get a list of all the ones that are stretchy
-            stretchies = [b for b in row if b.stretchy]
-            if not stretchies:  # Nothing stretches do as before.
-                bump = slack / len(row)
-                # The 1st box gets 0 bumps, the 2nd gets 1 and so on
-                for i, b in enumerate(row):
-                    b.x += bump * i
-            else:
-                bump = slack / len(stretchies)
-                # Each stretchy gets wider
-                for b in stretchies:
-                    b.w += bump
-                # And we put each thing next to the previous one
-                for j, b in enumerate(row[1:], 1):
-                    b.x = row[j - 1].x + row[j - 1].w + separation
+                if row.pop().stretchy:
+                    stretchies.pop()
+            justify_row(row, stretchies, frame.x + frame.w, separation)
 
         if break_line:
             # We start a new row
             row = []
-            # We go all the way left and a little down
-            box.x = pages[page].x
-            box.y = previous.y + previous.h + separation
-
-        # But if we go too far down
-        if box.y + box.h > pages[page].y + pages[page].h:
-            # We go to the next page
-            page += 1
-            # And put the box at the top-left
-            box.x = pages[page].x
-            box.y = pages[page].y
+            leading = True
+            stretchies = []
+            row_start = row_first = i
+            opportunities.clear()
+            last_break = room = None
+            frame = frames.next(i, box, previous, h_b)
 
         # Put the box in the row
         row.append(box)
 
         # Collapse all left-margin space
-        if all(b.letter == ' ' for b in row):
+        leading = leading and box.letter == ' '
+        if leading:
             box.w = 0
             box.stretchy = False
-            box.x = pages[page].x
+            box.x = frame.x
+        else:
+            if box.stretchy:
+                stretchies.append(box)
+            if box.letter in (' ', '\xad'):
+                opportunities.append(i)
+                if i > row_start:
+                    last_break = i
 
         previous = box
+        i += 1
 
-    # Remove leftover boxes
-    del (pages[page:])
+    return hyphens
+
+
+def break_paragraphs(
+    boxes,
+    width,
+    separation,
+    algorithm='greedy',
+    lookback=1,
+    jobs=1,
+    context=None,
+):
+    """Break boxes into rows of the given width.
+
+    Each paragraph (starting at a newline) is broken on its own, using
+    jobs processes. The rows are laid out starting at (0, 0), and can
+    be put on pages using paginate().
+
+    Each process loads context's font once, when it starts (see
+    fonts.preload). Processes only get the letters, widths and
+    stretchiness of the boxes, and only send back where rows start,
+    since pickling boxes takes longer than laying them out. The boxes
+    are then placed here, breaking rows there.
+
+    Returns a list of Row.
+    """
+    # Each paragraph is boxes[start:end]
+    starts = [0] + [
+        i for i, b in enumerate(boxes) if b.letter == '\n' and i > 0
+    ]
+    ends = starts[1:] + [len(boxes)]
+    rows = []
+    if jobs == 1:
+        for start, end in zip(starts, ends):
+            for row in break_paragraph(
+                boxes[start:end],
+                width,
+                separation,
+                algorithm,
+                lookback,
+                start > 0,
+                context,
+            ):
+                row.start += start
+                row.end += start
+                rows.append(row)
+        return rows
+
+    jobs_args = []
+    for start, end in zip(starts, ends):
+        paragraph = boxes[start:end]
+        jobs_args.append(
+            (
+                ''.join(b.letter for b in paragraph),
+                array('d', [b.w for b in paragraph]),
+                bytes(b.stretchy for b in paragraph),
+                width,
+                separation,
+                algorithm,
+                lookback,
+                start > 0,
+            )
+        )
+    with ProcessPoolExecutor(
+        jobs, initializer=preload, initargs=(context,)
+    ) as pool:
+        results = pool.map(
+            _break_paragraph_job,
+            jobs_args,
+            chunksize=max(1, len(jobs_args) // (jobs * 4)),
+        )
+        for start, end, breaks in zip(starts, ends, results):
+            # We place our boxes, breaking rows where the job did
+            for row in break_paragraph(
+                boxes[start:end],
+                width,
+                separation,
+                algorithm,
+                lookback,
+                start > 0,
+                context,
+                set(breaks),
+            ):
+                row.start += start
+                row.end += start
+                rows.append(row)
+    return rows
+
+
+def break_paragraph(
+    boxes,
+    width,
+    separation,
+    algorithm,
+    lookback,
+    continues,
+    context=None,
+    breaks=None,
+):
+    """Break a paragraph into rows starting at (0, 0). Returns the rows.
+
+    If breaks is given, rows start at those boxes (see place_rows).
+    """
+    frames = RowFrames(width)
+    place_rows(
+        boxes,
+        frames,
+        separation,
+        algorithm,
+        lookback,
+        continues,
+        context,
+        breaks,
+    )
+    frames.rows[-1].end = len(boxes)
+    return frames.rows
+
+
+def _break_paragraph_job(args):
+    """Run break_paragraph in another process, on boxes made from
+    letters, widths and stretchiness. Returns where its rows start."""
+    letters, widths, stretchy = args[:3]
+    boxes = [
+        Box(w=w, stretchy=bool(st), letter=l)
+        for l, w, st in zip(letters, widths, stretchy)
+    ]
+    rows = break_paragraph(boxes, *args[3:])
+    return [row.start for row in rows[1:]]
+
+
+def paginate(boxes, rows, pages, separation, after=None, breaks=None):
+    """Put rows laid out by break_paragraphs on pages.
+
+    after is where the row before these was put, as (page, y, height),
+    if they don't go at the beginning of the first page.
+
+    If breaks is given, it's the set of indexes of the rows that go at
+    the top of a new page (see optimal_page_breaks). Otherwise rows go
+    to the next page when they don't fit.
+
+    Returns where each row was put, as (page, y).
+    """
+    if after is None:
+        page, y = 0, None
+    else:
+        page, y, height = after
+    positions = []
+    for k, row in enumerate(rows):
+        if y is None:
+            y = pages[page].y
+        else:
+            if k > 0:
+                height = boxes[rows[k - 1].end - 1].h
+            # We go a little down
+            y = y + height + separation
+            # But if we go too far down
+            # (or we already decided to break here)
+            if (
+                y + boxes[row.start].h > pages[page].y + pages[page].h
+                if breaks is None
+                else k in breaks
+            ):
+                # We go to the next page
+                page += 1
+                y = pages[page].y
+        x = pages[page].x
+        for i in range(row.start, row.end):
+            boxes[i].x += x
+            boxes[i].y = y
+        if row.hyphen:
+            row.hyphen.x += x
+            row.hyphen.y = y
+        positions.append((page, y))
+    return positions
+
+
+def optimal_page_breaks(
+    boxes, rows, pages, separation, widow_penalty=10, orphan_penalty=10
+):
+    """Choose where to break pages looking at all rows.
+
+    Instead of going to the next page only when a row doesn't fit,
+    find the page breaks that make the sum of the squared space left
+    at the bottom of each page (but the last) as small as possible.
+
+    Breaking a page before the last row of a paragraph leaves a widow,
+    and after its first row an orphan. Each costs as much as its
+    penalty, in the same units as the squared space.
+
+    A page holds a limited number of rows, so for each row we only
+    look back that many rows, and the time this takes grows linearly
+    with the number of rows.
+
+    If pages have different heights, each page is as tall as the page
+    it would be in the best breaks up to it.
+
+    Returns the set of indexes of the rows that go at the top of a
+    new page (not counting the first row).
+    """
+    n = len(rows)
+    # How far down each row is from the 1st one, if on the same page
+    tops = [0] * (n + 1)
+    for k, row in enumerate(rows):
+        tops[k + 1] = tops[k] + boxes[row.end - 1].h + separation
+    # Rows that start and end a paragraph
+    first = [
+        k == 0 or boxes[row.start].letter == '\n'
+        for k, row in enumerate(rows)
+    ]
+    last = first[1:] + [True]
+
+    # For each row that can start a page: the total demerits up to
+    # it, the previous page break, and the page and its height.
+    total = [0] * (n + 1)
+    previous = [None] * (n + 1)
+    page_of = [0] * (n + 1)
+    height_of = [pages[0].h] * (n + 1)
+    for j in range(1, n + 1):
+        # How far down the last row would end
+        end = tops[j - 1] + boxes[rows[j - 1].start].h
+        penalty = 0
+        if j < n:
+            if last[j] and not first[j]:
+                penalty += widow_penalty
+            if first[j - 1] and not last[j - 1]:
+                penalty += orphan_penalty
+        # Put rows[i:j] in a page, starting with the shortest page
+        best = None
+        for i in range(j - 1, -1, -1):
+            bottom = end - tops[i]
+            height = height_of[i]
+            if bottom > height and i < j - 1:
+                # Longer pages won't fit either
+                break
+            demerits = total[i]
+            if j < n:
+                # The last page doesn't need to be full
+                demerits += penalty
+                if bottom < height:
+                    demerits += (height - bottom) ** 2
+            if best is None or demerits < total[j]:
+                best = i
+                total[j] = demerits
+        previous[j] = best
+        if j < n:
+            page_of[j] = page_of[best] + 1
+            height_of[j] = pages[page_of[j]].h
+
+    # Walk back from the end, remembering breaks
+    breaks = set()
+    i = previous[n]
+    while i:
+        breaks.add(i)
+        i = previous[i]
+    return breaks
+
+
+def justify_row(row, stretchies, right, separation):
+    """Make the row reach all the way to the right margin.
+
+    stretchies are the stretchy boxes in the row.
+    """
+    slack = right - (row[-1].x + row[-1].w)
+    if not stretchies:  # Nothing stretches do as before.
+        bump = slack / len(row)
+        # The 1st box gets 0 bumps, the 2nd gets 1 and so on
+        for i, b in enumerate(row):
+            b.x += bump * i
+    else:
+        bump = slack / len(stretchies)
+        # Each stretchy gets wider
+        for b in stretchies:
+            b.w += bump
+        # And we put each thing next to the previous one
+        for j, b in enumerate(row[1:], 1):
+            b.x = row[j - 1].x + row[j - 1].w + separation
 
 
 def draw_boxes(boxes, pages, fname, size, hide_boxes=False):
@@ -184,8 +1006,19 @@ def draw_boxes(boxes, pages, fname, size, hide_boxes=False):
                     fill=color,
                 )
             )
+        # A word has all its letters, each in its place
+        if isinstance(box, Word):
+            dwg.add(
+                dwg.text(
+                    box.letter,
+                    x=[box.x + o for o in box.offsets],
+                    y=[box.y + box.h],
+                    font_size=box.h,
+                    font_family='Arial',
+                )
+            )
         # Display the letter in the box
-        if box.letter:
+        elif box.letter:
             dwg.add(
                 dwg.text(
                     box.letter,
@@ -197,34 +1030,220 @@ def draw_boxes(boxes, pages, fname, size, hide_boxes=False):
     dwg.save()
 
 
-def create_text_boxes(input_file):
+def create_text_boxes(input_file, box_array=False, context=None):
+    """Create a box for each letter in the input file.
+
+    If box_array is True, the boxes are stored in a BoxArray, which
+    takes much less memory than a list of Box.
+
+    Letters are shaped with context, a fonts.FontContext.
+    """
     p_and_p = open(input_file).read()
     p_and_p = insert_soft_hyphens(p_and_p)  # Insert invisible hyphens
+    if box_array:
+        return BoxArray.from_advances(p_and_p, advances(p_and_p, context))
     text_boxes = []
     for l in p_and_p:
         text_boxes.append(Box(letter=l, stretchy=l == ' '))
-    adjust_widths_by_letter(text_boxes)
+    adjust_widths_by_letter(text_boxes, context)
     return text_boxes
 
 
-def create_pages(page_size):
-    # A few pages all the same size
-    w, h = page_size
-    pages = [Box(i * (w + 5), 0, w, h) for i in range(1000)]
-    return pages
+def create_pages(page_size, first=None, recto=None, verso=None):
+    """As many pages as needed, page_size unless said otherwise.
+
+    first, recto and verso are the sizes of the first page, and of
+    the right (odd) and left (even) pages after it.
+    """
+    return Pages(page_size, first, recto, verso)
+
+
+class Pages():
+    """Pages side by side, created only when they are first used.
+
+    This works like a list of Box, but it's never too short: asking
+    for a page past the end creates it, and those before it.
+    Its length is how many pages have been created so far.
+    """
+
+    def __init__(self, page_size, first=None, recto=None, verso=None):
+        self.first = first or page_size
+        self.recto = recto or page_size
+        self.verso = verso or page_size
+        # Space between pages
+        self.gap = 5
+        self._pages = []
+
+    def size(self, i):
+        """The size of page i, counting from 0."""
+        if i == 0:
+            return self.first
+        # Page i is page number i + 1, so odd i are even pages
+        return self.verso if i % 2 else self.recto
+
+    def _create(self, count):
+        """Make sure there are at least count pages."""
+        while len(self._pages) < count:
+            if self._pages:
+                last = self._pages[-1]
+                x = last.x + last.w + self.gap
+            else:
+                x = 0
+            w, h = self.size(len(self._pages))
+            self._pages.append(Box(x, 0, w, h))
 
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if i.stop is not None and i.stop > 0:
+                self._create(i.stop)
+        elif i >= 0:
+            self._create(i + 1)
+        return self._pages[i]
 
-def convert(input, output, page_size=(30, 50), separation=0.05):
+    def __delitem__(self, i):
+        del self._pages[i]
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __iter__(self):
+        return iter(self._pages)
+
+
+def convert(
+    input,
+    output,
+    page_size=(30, 50),
+    separation=0.05,
+    algorithm='greedy',
+    lookback=1,
+    jobs=None,
+    box_array=False,
+    backend='python',
+    pagination='greedy',
+    index=None,
+    context=None,
+):
+    """Lay out the text in input, and draw it in output.
+
+    If index is given, it's where to save a search index.
+
+    Text is shaped with context, a fonts.FontContext, or with this
+    process's default one.
+
+    Returns the laid out boxes, and the pages.
+    """
     pages = create_pages(page_size)
-    text_boxes = create_text_boxes(input)
-    layout(text_boxes, pages, separation)
+    if backend == 'numpy':
+        if (algorithm, lookback, jobs, pagination) != (
+            'greedy',
+            1,
+            None,
+            'greedy',
+        ) or index:
+            raise ValueError('The numpy backend only does greedy layout')
+        rows = break_arrays(
+            create_text_boxes(input, True, context),
+            pages,
+            separation,
+            context,
+        )
+        # Remove leftover boxes
+        if len(rows):
+            del (pages[rows.page[-1]:])
+        # Only now we work out where each box goes
+        text_boxes = rows.laid_out()
+    elif backend == 'python':
+        text_boxes = create_text_boxes(input, box_array, context)
+        writer = IndexWriter(text_boxes) if index else None
+        layout(
+            text_boxes,
+            pages,
+            separation,
+            algorithm,
+            lookback,
+            jobs,
+            pagination,
+            writer,
+            context,
+        )
+        if writer:
+            writer.save(index)
+    elif backend == 'items':
+        if index:
+            raise ValueError('The items backend can\'t save an index')
+        with open(input) as f:
+            text_boxes = create_items(f.read(), separation, context)
+        layout(
+            text_boxes,
+            pages,
+            separation,
+            algorithm,
+            lookback,
+            jobs,
+            pagination,
+            context=context,
+        )
+    else:
+        raise ValueError('Unknown backend: %s' % backend)
+    if not len(pages):
+        # There was no text, so nothing made a page: we draw a blank one
+        pages[0]
     draw_boxes(
         text_boxes,
         pages,
         output,
-        (pages[-1].w + pages[-1].x, pages[-1].h),
+        (pages[-1].w + pages[-1].x, max(p.h for p in pages)),
         True,
     )
+    return text_boxes, pages
+
+
+# The options only some ways of laying out take, with their defaults
+SPECIFIC_OPTIONS = {
+    '--jobs': None,
+    '--pagination': 'greedy',
+    '--columns': '1',
+    '--column-gap': '1',
+    '--box-array': False,
+    '--backend': 'python',
+    '--pages': None,
+    '--max-pages': None,
+    '--checkpoints': False,
+    '--marks': False,
+    '--index': False,
+    '--cache': None,
+}
+
+# Which of them each way takes: with --marks, --cache, --columns or
+# --pages, or None for convert()
+TAKES = {
+    '--marks': {'--marks'},
+    '--cache': {'--cache'},
+    '--columns': {'--columns', '--column-gap', '--jobs'},
+    '--pages': {'--pages', '--max-pages', '--checkpoints'},
+    None: {'--jobs', '--pagination', '--box-array', '--backend', '--index'},
+}
+
+
+def check_options(arguments, way):
+    """Refuse the options the way of laying out doesn't take, instead
+    of quietly laying out without them."""
+    wrong = [
+        option
+        for option, default in SPECIFIC_OPTIONS.items()
+        if arguments[option] != default and option not in TAKES[way]
+    ]
+    if wrong and way:
+        raise SystemExit(
+            'Can\'t use %s with %s' % (', '.join(wrong), way)
+        )
+    if wrong:
+        needed = [w for w in TAKES if w and TAKES[w] & set(wrong)]
+        raise SystemExit(
+            'Can\'t use %s without %s'
+            % (', '.join(wrong), ' or '.join(needed))
+        )
 
 
 if __name__ == '__main__':
@@ -241,9 +1260,198 @@ if __name__ == '__main__':
         separation = 0.05
 
 
-    convert(
-        input=arguments['<input>'],
-        output=arguments['<output>'],
-        page_size=p_size,
-        separation=separation,
-    )
+    if arguments['--stats']:
+        # Imported here, since it imports us
+        from stats import file_stats
+
+        print(
+            json.dumps(
+                file_stats(arguments['<input>'], p_size, separation),
+                indent=2,
+            )
+        )
+    elif arguments['--estimate']:
+        # Imported here, since it imports us
+        from estimate import estimate_pages
+
+        with open(arguments['<input>']) as f:
+            text = f.read()
+        print(
+            json.dumps(
+                estimate_pages(text, p_size, separation), indent=2
+            )
+        )
+    elif arguments['--copyfit']:
+        # Imported here, since it imports us
+        from copyfit import copyfit_file
+
+        try:
+            result = copyfit_file(
+                arguments['<input>'],
+                int(arguments['--copyfit']),
+                arguments['--fit'],
+                low=float(arguments['--low'])
+                if arguments['--low']
+                else None,
+                high=float(arguments['--high'])
+                if arguments['--high']
+                else None,
+                page_size=p_size,
+                separation=separation,
+            )
+        except ValueError as e:
+            # It doesn't fit in that many pages, or can't be fitted
+            raise SystemExit('Can\'t copyfit: %s' % e)
+        print(json.dumps(result, indent=2))
+    elif arguments['--marks']:
+        check_options(arguments, '--marks')
+        # Imported here, since it imports us
+        from references import convert_marked
+
+        doc = convert_marked(
+            input=arguments['<input>'],
+            output=arguments['<output>'],
+            page_size=p_size,
+            separation=separation,
+            algorithm=arguments['--algorithm'],
+            lookback=int(arguments['--lookback']),
+        )
+        print(
+            'Page numbers %s after %s iterations, in %.3f seconds'
+            % (
+                'settled' if doc.converged else 'did not settle',
+                doc.iterations,
+                doc.seconds,
+            )
+        )
+        text_boxes, pages = doc.boxes, doc.pages
+    elif arguments['--out-of-core']:
+        # Imported here, since it imports us
+        from outofcore import draw_out_of_core, layout_out_of_core
+        from stream import parse_page_range
+
+        files, rss = layout_out_of_core(
+            input=arguments['<input>'],
+            directory=arguments['--out-of-core'],
+            page_size=p_size,
+            separation=separation,
+            algorithm=arguments['--algorithm'],
+            lookback=int(arguments['--lookback']),
+        )
+        if arguments['--pages'] or arguments['--max-pages']:
+            first, last = parse_page_range(
+                arguments['--pages'], arguments['--max-pages']
+            )
+        else:
+            first, last = 1, 1
+        try:
+            draw_out_of_core(
+                arguments['--out-of-core'],
+                arguments['<output>'],
+                first,
+                last,
+            )
+        except ValueError as e:
+            # The text doesn't have the pages asked for
+            raise SystemExit('Can\'t draw: %s' % e)
+        print(
+            json.dumps(
+                {
+                    'boxes': files.size,
+                    'pages': files.page_count,
+                    'peak_rss_mb': round(rss / 2 ** 20, 1),
+                },
+                indent=2,
+            )
+        )
+    elif arguments['--cache']:
+        check_options(arguments, '--cache')
+        # Imported here, since it imports us
+        from cache import LayoutCache, convert_cached
+
+        cache = LayoutCache(arguments['--cache'])
+        doc = convert_cached(
+            input=arguments['<input>'],
+            output=arguments['<output>'],
+            cache=cache,
+            page_size=p_size,
+            separation=separation,
+            algorithm=arguments['--algorithm'],
+            lookback=int(arguments['--lookback']),
+        )
+        print(
+            'Reused %d paragraphs, laid out %d'
+            % (cache.hits + cache.disk_hits, cache.misses)
+        )
+        text_boxes, pages = doc.boxes, doc.pages
+    elif int(arguments['--columns']) > 1:
+        check_options(arguments, '--columns')
+        # Imported here, since it imports us
+        from columns import convert_columns
+
+        text_boxes, pages = convert_columns(
+            input=arguments['<input>'],
+            output=arguments['<output>'],
+            page_size=p_size,
+            separation=separation,
+            columns=int(arguments['--columns']),
+            gap=float(arguments['--column-gap']),
+            algorithm=arguments['--algorithm'],
+            lookback=int(arguments['--lookback']),
+            jobs=int(arguments['--jobs']) if arguments['--jobs'] else 1,
+        )
+    elif arguments['--pages'] or arguments['--max-pages']:
+        check_options(arguments, '--pages')
+        # Imported here, since it imports us
+        from stream import convert_pages, parse_page_range
+
+        first, last = parse_page_range(
+            arguments['--pages'], arguments['--max-pages']
+        )
+        text_boxes, pages = convert_pages(
+            input=arguments['<input>'],
+            output=arguments['<output>'],
+            page_size=p_size,
+            separation=separation,
+            first=first,
+            last=last,
+            algorithm=arguments['--algorithm'],
+            lookback=int(arguments['--lookback']),
+            checkpoints=arguments['<output>'] + '.checkpoints'
+            if arguments['--checkpoints']
+            else None,
+        )
+    else:
+        check_options(arguments, None)
+        try:
+            text_boxes, pages = convert(
+                input=arguments['<input>'],
+                output=arguments['<output>'],
+                page_size=p_size,
+                separation=separation,
+                algorithm=arguments['--algorithm'],
+                lookback=int(arguments['--lookback']),
+                jobs=int(arguments['--jobs'])
+                if arguments['--jobs']
+                else None,
+                box_array=arguments['--box-array'],
+                backend=arguments['--backend'],
+                pagination=arguments['--pagination'],
+                index=arguments['<output>'] + '.index'
+                if arguments['--index']
+                else None,
+            )
+        except ValueError as e:
+            # A backend that can't lay out like that, or an unknown
+            # algorithm, backend or pagination
+            raise SystemExit('Can\'t lay out: %s' % e)
+        # Layout removes the last page it used with the leftover ones,
+        # but it has boxes on it. Pages makes it again.
+        pages = pages[: len(pages) + 1]
+
+    # Whichever way it was laid out
+    if arguments['--validate']:
+        report = validate(text_boxes, pages)
+        print(json.dumps(report, indent=2))
+        if report['overlaps'] or report['off_page']:
+            raise SystemExit(1)
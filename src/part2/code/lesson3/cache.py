@@ -0,0 +1,199 @@
+"""Remember how paragraphs were laid out, to reuse them."""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from boxes import Box, Row
+from document import Document, Paragraph
+from fonts import default_context
+from hyphen import LANGUAGE
+
+# Change it when what's saved changes, so old files are not used
+VERSION = 1
+
+
+class LayoutCache():
+    """Paragraphs broken into rows, by what makes them look that way.
+
+    A paragraph's rows only depend on its text, the font, the page
+    width, the separation, the hyphenation language and how rows are
+    broken. A hash of all that is the paragraph's key, so the same
+    paragraph is laid out once, even if it's in many places, or in
+    many runs.
+
+    The rows are kept as they are before being put on pages: starting
+    at (0, 0). The last size paragraphs used are kept in memory. If
+    directory is given, they are also saved there, one file each, so
+    other runs can use them.
+
+    Paragraphs are shaped with context, a fonts.FontContext, or this
+    process's default one.
+
+    hits, disk_hits and misses count the paragraphs that were found in
+    memory, found in directory, or had to be laid out.
+    """
+
+    def __init__(self, directory=None, size=10000, context=None):
+        self.directory = directory
+        self.size = size
+        self.context = context or default_context()
+        self._memory = OrderedDict()
+        self.hits = self.disk_hits = self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, line, continues, width, separation, algorithm, lookback):
+        """The hash of everything a paragraph's rows depend on."""
+        settings = [
+            VERSION,
+            line,
+            continues,
+            self.context.font_name,
+            self.context.size,
+            LANGUAGE,
+            float(width),
+            float(separation),
+            algorithm,
+            lookback,
+        ]
+        # repr() is enough to tell apart these strings and numbers,
+        # and much faster than json for long paragraphs.
+        return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+    def paragraph(
+        self,
+        line,
+        continues,
+        width,
+        separation,
+        algorithm='greedy',
+        lookback=1,
+    ):
+        """A Paragraph for line, broken into rows.
+
+        Like Paragraph(line, continues) followed by break_rows(), but
+        if it was done before, the rows are taken from the cache.
+        """
+        key = self.key(
+            line, continues, width, separation, algorithm, lookback
+        )
+        saved = self._get(key)
+        if saved is not None:
+            return unpack_paragraph(line, continues, saved, self.context)
+        self.misses += 1
+        p = Paragraph(line, continues, context=self.context)
+        p.break_rows(width, separation, algorithm, lookback)
+        saved = pack_paragraph(p)
+        self._remember(key, saved)
+        if self.directory:
+            self._save(key, saved)
+        return p
+
+    def _get(self, key):
+        saved = self._memory.get(key)
+        if saved is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return saved
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            # Not there, or not saved right: it's laid out again
+            return None
+        self.disk_hits += 1
+        self._remember(key, saved)
+        return saved
+
+    def _remember(self, key, saved):
+        self._memory[key] = saved
+        while len(self._memory) > self.size:
+            # Forget the paragraph used longest ago
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _save(self, key, saved):
+        # Write it under another name first, so other runs never see
+        # half a file.
+        path = self._path(key)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'w') as f:
+            json.dump(saved, f)
+        os.replace(temp, path)
+
+
+def pack_paragraph(p):
+    """What's needed to rebuild a Paragraph, broken into rows.
+
+    That's its boxes as they were left by break_rows(), the rows, and
+    the hyphens added to them, as something json can save.
+    """
+    return {
+        'letters': ''.join(b.letter for b in p.boxes),
+        'stretchy': [i for i, b in enumerate(p.boxes) if b.stretchy],
+        'w': [b.w for b in p.all_boxes()],
+        'x': p.xs,
+        'rows': [[r.start, r.end, bool(r.hyphen)] for r in p.rows],
+    }
+
+
+def unpack_paragraph(line, continues, saved, context=None):
+    """The Paragraph for line saved by pack_paragraph()."""
+    letters, ws, xs = saved['letters'], saved['w'], saved['x']
+    stretchy = [False] * len(letters)
+    for i in saved['stretchy']:
+        stretchy[i] = True
+    boxes = [
+        Box(x, 0, w, 1, s, l)
+        for l, x, w, s in zip(letters, xs, ws, stretchy)
+    ]
+    p = Paragraph(line, continues, boxes, context)
+    # Hyphens come after the boxes, in the order of their rows
+    i = len(boxes)
+    for start, end, hyphen in saved['rows']:
+        row = Row(start, end)
+        if hyphen:
+            row.hyphen = Box(xs[i], 0, ws[i], 1, False, '-')
+            i += 1
+        p.rows.append(row)
+    p.xs = xs
+    return p
+
+
+def convert_cached(
+    input,
+    output,
+    cache,
+    page_size=(30, 50),
+    separation=0.05,
+    algorithm='greedy',
+    lookback=1,
+    context=None,
+):
+    """Lay out the text in input, and draw it in output.
+
+    Paragraphs are taken from cache, a LayoutCache, if they are in it,
+    and added to it if not. The cache shapes them with its own
+    fonts.FontContext, which context should be the same as.
+
+    Returns the Document.
+    """
+    with open(input) as f:
+        text = f.read()
+    doc = Document(
+        text,
+        page_size,
+        separation,
+        algorithm,
+        lookback,
+        cache,
+        context,
+    )
+    doc.draw(output)
+    return doc
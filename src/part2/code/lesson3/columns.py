@@ -0,0 +1,176 @@
+"""Lay out text in columns, with the last page's columns balanced."""
+
+from boxes import (
+    Box,
+    break_paragraphs,
+    create_pages,
+    create_text_boxes,
+    draw_boxes,
+    paginate,
+)
+
+
+class RowHeights():
+    """How tall a sequence of rows is, to fill columns quickly.
+
+    Filling a column only looks at these numbers, not at the boxes,
+    so we can try many column heights cheaply.
+    """
+
+    def __init__(self, boxes, rows, separation):
+        # How far down each row is from the 1st one, if in one column
+        self.tops = tops = [0] * (len(rows) + 1)
+        for k, row in enumerate(rows):
+            tops[k + 1] = tops[k] + boxes[row.end - 1].h + separation
+        # How tall each row is, as paginate() sees it
+        self.heights = [boxes[row.start].h for row in rows]
+
+    def __len__(self):
+        return len(self.heights)
+
+    def fill(self, start, height):
+        """Fill a column of this height with rows, starting at start.
+
+        Returns the index of the first row that doesn't fit. A column
+        always gets at least one row.
+        """
+        tops, heights = self.tops, self.heights
+        k = start + 1
+        while k < len(heights) and (
+            tops[k] - tops[start] + heights[k] <= height
+        ):
+            k += 1
+        return k
+
+    def columns(self, start, height, limit):
+        """How many columns of this height the rows from start need.
+
+        Stops counting after limit.
+        """
+        count = 0
+        while start < len(self) and count <= limit:
+            start = self.fill(start, height)
+            count += 1
+        return count
+
+
+def column(page, i, columns, gap):
+    """Column i of a page split in columns, with gap between them."""
+    w = (page.w - gap * (columns - 1)) / columns
+    return Box(page.x + i * (w + gap), page.y, w, page.h)
+
+
+def layout_columns(
+    _boxes,
+    pages,
+    separation,
+    columns=2,
+    gap=1,
+    balance=True,
+    algorithm='greedy',
+    lookback=1,
+    jobs=1,
+    context=None,
+):
+    """Layout boxes in columns along pages.
+
+    Like layout(..., jobs=...), this modifies the boxes, and needs all
+    pages to be as wide as the first one.
+
+    If balance is True, the columns in the last page are made as short
+    as possible, so they end at about the same height. That height is
+    found by bisection, filling columns using only the row heights,
+    which are measured once.
+
+    context is the fonts.FontContext that hyphens are measured with.
+    """
+    if not _boxes:
+        return
+    width = column(pages[0], 0, columns, gap).w
+    rows = break_paragraphs(
+        _boxes, width, separation, algorithm, lookback, jobs, context
+    )
+    heights = RowHeights(_boxes, rows, separation)
+
+    # Fill columns one after the other. For each column, its frame and
+    # its first row.
+    frames = []
+    starts = []
+    k = 0
+    while k < len(rows):
+        page = pages[len(frames) // columns]
+        frames.append(column(page, len(frames) % columns, columns, gap))
+        starts.append(k)
+        k = heights.fill(k, page.h)
+    last_page = (len(frames) - 1) // columns
+
+    if balance:
+        # The shortest height that fits the last page's rows in its
+        # columns. They fit at full height, and not at 0.
+        first = last_page * columns
+        k = starts[first]
+        low, high = 0, pages[last_page].h
+        while high - low > 1e-6:
+            middle = (low + high) / 2
+            if heights.columns(k, middle, columns) > columns:
+                low = middle
+            else:
+                high = middle
+        # Fill the last page again, with shorter columns
+        del frames[first:], starts[first:]
+        while k < len(rows):
+            frame = column(
+                pages[last_page], len(frames) % columns, columns, gap
+            )
+            frame.h = high
+            frames.append(frame)
+            starts.append(k)
+            k = heights.fill(k, high)
+
+    paginate(_boxes, rows, frames, separation, breaks=set(starts[1:]))
+    _boxes.extend(row.hyphen for row in rows if row.hyphen)
+    # Remove leftover pages
+    del (pages[last_page + 1 :])
+
+
+def convert_columns(
+    input,
+    output,
+    page_size=(30, 50),
+    separation=0.05,
+    columns=2,
+    gap=1,
+    algorithm='greedy',
+    lookback=1,
+    jobs=1,
+    context=None,
+):
+    """Like convert(), but laying out text in columns.
+
+    Text is shaped with context, a fonts.FontContext, or with this
+    process's default one.
+
+    Returns the laid out boxes, and the pages.
+    """
+    pages = create_pages(page_size)
+    text_boxes = create_text_boxes(input, context=context)
+    layout_columns(
+        text_boxes,
+        pages,
+        separation,
+        columns,
+        gap,
+        True,
+        algorithm,
+        lookback,
+        jobs,
+        context,
+    )
+    draw_boxes(
+        text_boxes,
+        pages,
+        output,
+        (pages[-1].w + pages[-1].x, max(p.h for p in pages)),
+        True,
+    )
+    return text_boxes, pages
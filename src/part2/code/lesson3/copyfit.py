@@ -0,0 +1,101 @@
+"""Find the page size or separation that makes a text fit N pages."""
+
+from boxes import create_pages
+from numpy_layout import break_arrays
+from sweep import shape_text
+
+
+def copyfit(
+    boxes,
+    pages,
+    parameter='width',
+    low=None,
+    high=None,
+    page_size=(30, 50),
+    separation=0.05,
+    tolerance=0.001,
+    context=None,
+):
+    """Find the value of parameter that lays out boxes in pages pages.
+
+    parameter is 'width' or 'height' of the pages, or 'separation',
+    and its value is searched between low and high by bisection, until
+    it's known within tolerance times (high - low). The other two are
+    as given.
+
+    Pages get fewer as they get wider or taller, so we look for the
+    smallest width or height that fits the boxes in that many pages.
+    They get more with more separation, so we look for the largest
+    separation that does.
+
+    boxes is a BoxArray, as made by sweep.shape_text(), and each probe
+    is a layout with break_arrays(), which doesn't modify it. Hyphens
+    are as wide as context, a fonts.FontContext, says.
+
+    Returns a dict with the value found, how many pages it gives
+    (fewer than asked for if no value gives exactly that many) and
+    how many layouts it took.
+    """
+    width, height = page_size
+    defaults = {
+        'width': (width / 4, width * 4),
+        'height': (height / 4, height * 4),
+        'separation': (0, 1),
+    }
+    if parameter not in defaults:
+        raise ValueError('Unknown parameter: %s' % parameter)
+    if low is None:
+        low = defaults[parameter][0]
+    if high is None:
+        high = defaults[parameter][1]
+    probes = []
+
+    def count(value):
+        """How many pages we get with parameter set to value."""
+        size = {'width': (value, height), 'height': (width, value)}
+        rows = break_arrays(
+            boxes,
+            create_pages(size.get(parameter, page_size)),
+            value if parameter == 'separation' else separation,
+            context,
+        )
+        probes.append(value)
+        return rows.pages()
+
+    # fits is where the boxes fit, and misses where they don't
+    if parameter == 'separation':
+        fits, misses = low, high
+    else:
+        fits, misses = high, low
+    fits_count = count(fits)
+    if fits_count > pages:
+        raise ValueError(
+            'Even with %s %s, it takes %s pages'
+            % (parameter, fits, fits_count)
+        )
+    misses_count = count(misses)
+    if misses_count <= pages:
+        # It fits anywhere in the range
+        fits, fits_count = misses, misses_count
+    else:
+        while abs(fits - misses) > tolerance * (high - low):
+            middle = (fits + misses) / 2
+            middle_count = count(middle)
+            if middle_count <= pages:
+                fits, fits_count = middle, middle_count
+            else:
+                misses = middle
+    return {
+        'parameter': parameter,
+        'value': fits,
+        'pages': fits_count,
+        'layouts': len(probes),
+    }
+
+
+def copyfit_file(input, pages, parameter='width', context=None, **kwargs):
+    """copyfit() for the text in a file, shaping it only once, with
+    context."""
+    with open(input) as f:
+        boxes = shape_text(f.read(), context)
+    return copyfit(boxes, pages, parameter, context=context, **kwargs)
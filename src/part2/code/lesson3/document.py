@@ -0,0 +1,230 @@
+"""A document that can be laid out again quickly after it's edited."""
+
+from bisect import bisect_right
+from itertools import accumulate
+
+from boxes import Box, break_paragraph, create_pages, draw_boxes, paginate
+from fonts import adjust_widths_by_letter
+from hyphen import insert_soft_hyphens
+
+
+class Paragraph():
+    """One line of the document's text, and how it was laid out."""
+
+    def __init__(self, line, continues, boxes=None, context=None):
+        self.line = line
+        self.continues = continues
+        # The fonts.FontContext to shape it, and measure hyphens, with
+        self.context = context
+        # Boxes of the paragraph. All but the first one start with a
+        # newline, just like create_text_boxes() would give us.
+        # They can be given, already shaped (see cache.LayoutCache).
+        if boxes is None:
+            text = insert_soft_hyphens(line)
+            if continues:
+                text = '\n' + text
+            boxes = [Box(letter=l, stretchy=l == ' ') for l in text]
+            if boxes:
+                adjust_widths_by_letter(boxes, context)
+        self.boxes = boxes
+        # Rows are laid out from (0, 0), before putting them on pages
+        self.rows = []
+        # Where the row before this paragraph was put, and where its
+        # last row was put: (page, y, height)
+        self.after = self.end = None
+        # Where each row was put: (page, y)
+        self.positions = []
+
+    def break_rows(self, width, separation, algorithm, lookback):
+        if self.boxes:
+            self.rows = break_paragraph(
+                self.boxes,
+                width,
+                separation,
+                algorithm,
+                lookback,
+                self.continues,
+                self.context,
+            )
+        # Remember where the boxes are in their rows, to put them on
+        # pages as many times as needed.
+        self.xs = [b.x for b in self.all_boxes()]
+
+    def all_boxes(self):
+        """The paragraph's boxes, and the hyphens added to them."""
+        hyphens = [row.hyphen for row in self.rows if row.hyphen]
+        return self.boxes + hyphens
+
+    def place(self, pages, separation, after):
+        """Put the paragraph's rows on pages, after the given position.
+
+        Returns the position of its last row, as paginate() takes it.
+        """
+        for b, x in zip(self.all_boxes(), self.xs):
+            b.x = x
+        self.after = after
+        self.positions = paginate(
+            self.boxes, self.rows, pages, separation, after
+        )
+        if self.rows:
+            page, y = self.positions[-1]
+            self.end = page, y, self.boxes[self.rows[-1].end - 1].h
+        else:
+            self.end = after
+        return self.end
+
+    def pages(self):
+        """The pages this paragraph's rows are on."""
+        return {page for page, y in self.positions}
+
+
+class Document():
+    """A text, laid out on pages, that can be edited.
+
+    After an edit, only the edited paragraphs are hyphenated, shaped
+    and broken into rows again. Then the rows are put on pages from
+    there on, until the pages look like before the edit.
+
+    Like layout(..., jobs=...), all pages must be the same width.
+
+    If cache is given (see cache.LayoutCache), paragraphs that were
+    laid out before, by this or any document using the same cache, are
+    not laid out again: their rows are only put on pages. Otherwise,
+    they are shaped with context, a fonts.FontContext.
+    """
+
+    def __init__(
+        self,
+        text,
+        page_size=(30, 50),
+        separation=0.05,
+        algorithm='greedy',
+        lookback=1,
+        cache=None,
+        context=None,
+    ):
+        self.separation = separation
+        self.algorithm = algorithm
+        self.lookback = lookback
+        self.cache = cache
+        self.context = context
+        self._pages = create_pages(page_size)
+        self.paragraphs = self._paragraphs(
+            text.splitlines(keepends=True), 0
+        )
+        self._offsets()
+        self._place(0, 0)
+
+    @property
+    def text(self):
+        return ''.join(p.line for p in self.paragraphs)
+
+    @property
+    def boxes(self):
+        """All the boxes in the document, ready for draw_boxes()."""
+        boxes = []
+        for p in self.paragraphs:
+            boxes.extend(p.boxes)
+        for p in self.paragraphs:
+            boxes.extend(row.hyphen for row in p.rows if row.hyphen)
+        return boxes
+
+    @property
+    def pages(self):
+        """The pages that have something on them."""
+        for p in reversed(self.paragraphs):
+            if p.positions:
+                return self._pages[: p.positions[-1][0] + 1]
+        return []
+
+    def draw(self, fname, hide_boxes=True):
+        pages = self.pages
+        draw_boxes(
+            self.boxes,
+            pages,
+            fname,
+            (pages[-1].w + pages[-1].x, max(p.h for p in pages)),
+            hide_boxes,
+        )
+
+    def edit(self, start, end, text):
+        """Replace self.text[start:end] with text.
+
+        Returns the sorted list of pages that changed.
+        """
+        # The paragraphs that have the edited text: first to last
+        first = max(bisect_right(self.offsets, start) - 1, 0)
+        last = bisect_right(self.offsets, max(end - 1, start)) - 1
+        offset = self.offsets[first]
+        old = ''.join(p.line for p in self.paragraphs[first : last + 1])
+        new = old[: start - offset] + text + old[end - offset :]
+        # If the edit joins lines, or leaves the text without a first
+        # line, the next paragraph needs to be laid out again too.
+        while last + 1 < len(self.paragraphs) and (
+            not new
+            or new.splitlines() == [new]
+            or new.endswith('\r')
+        ):
+            last += 1
+            new += self.paragraphs[last].line
+
+        changed = set()
+        for p in self.paragraphs[first : last + 1]:
+            changed.update(p.pages())
+        lines = new.splitlines(keepends=True)
+        self.paragraphs[first : last + 1] = self._paragraphs(
+            lines, first
+        )
+        self._offsets()
+        changed.update(self._place(first, first + len(lines)))
+        return sorted(changed)
+
+    def _paragraphs(self, lines, first):
+        """Lay out lines into rows, as paragraphs starting at first."""
+        paragraphs = []
+        for k, line in enumerate(lines, first):
+            if self.cache is not None:
+                p = self.cache.paragraph(
+                    line,
+                    k > 0,
+                    self._pages[0].w,
+                    self.separation,
+                    self.algorithm,
+                    self.lookback,
+                )
+            else:
+                p = Paragraph(line, k > 0, context=self.context)
+                p.break_rows(
+                    self._pages[0].w,
+                    self.separation,
+                    self.algorithm,
+                    self.lookback,
+                )
+            paragraphs.append(p)
+        return paragraphs
+
+    def _offsets(self):
+        """Remember where each paragraph starts in the text."""
+        self.offsets = [0] + list(
+            accumulate(len(p.line) for p in self.paragraphs)
+        )[:-1]
+
+    def _place(self, first, edited):
+        """Put paragraphs on pages, starting at first.
+
+        Paragraphs before edited were just laid out, so they have to
+        be put on pages. Later ones only if they would move.
+
+        Returns the pages that changed.
+        """
+        after = self.paragraphs[first - 1].end if first > 0 else None
+        changed = set()
+        for k in range(first, len(self.paragraphs)):
+            p = self.paragraphs[k]
+            if k >= edited and p.after == after and p.positions:
+                # This and everything after it is where it was
+                break
+            changed.update(p.pages())
+            after = p.place(self._pages, self.separation, after)
+            changed.update(p.pages())
+        return changed
@@ -0,0 +1,235 @@
+"""
+Check that the different ways of laying out a text agree.
+
+Lays out each text with layout(), with every algorithm and lookback,
+and again with jobs and as a Document, and fails if any box is placed
+even slightly differently. Greedy layout is also done by the numpy
+and items backends, which only have to agree up to rounding.
+
+Usage:
+    equivalence [<input>] [--page-size=<WxH>] [--separation=<sep>]
+          [--lookback=<K>] [--jobs=<N>] [--size=<N>]
+
+Options:
+    --page-size=<WxH>   Size of the pages [default: 30x50]
+    --separation=<sep>  Space between boxes [default: 0.05]
+    --lookback=<K>      Try every lookback up to K [default: 4]
+    --jobs=<N>          Also try with N processes [default: 2]
+    --size=<N>          Characters in each adversarial text, used if
+                        there is no <input> [default: 3000]
+"""
+
+from adversarial import CASES
+from boxarray import BoxArray
+from boxes import Box, create_pages, layout
+from document import Document
+from fonts import adjust_widths_by_letter, advances
+from hyphen import insert_soft_hyphens
+from items import Hyphen, Word, create_items
+from numpy_layout import layout_arrays
+
+from docopt import docopt
+
+PROSE = (
+    'It is a truth universally acknowledged, that a single man in '
+    'possession of a good fortune, must be in want of a wife.\n'
+    '\n'
+    'However little known the feelings or views of such a man may be '
+    'on his first entering a neighbourhood, this truth is so well '
+    'fixed in the minds of the surrounding families, that he is '
+    'considered the rightful property of some one or other of their '
+    'daughters.\n'
+    '   “My dear Mr. Bennet,” said his lady to him one day, “have you '
+    'heard that Netherfield Park is let at last?”\n'
+)
+
+# Texts that start in odd ways, since the 1st box is not like the rest
+STARTS = {
+    'newline-first': 'I\n' + PROSE,
+    'blank-lines-first': '\n\n' + PROSE,
+    'spaces-first': '   ' + PROSE,
+}
+
+
+def text_boxes(text):
+    """A box per letter of text, hyphenated like create_text_boxes()."""
+    text = insert_soft_hyphens(text)
+    boxes = [Box(letter=l, stretchy=l == ' ') for l in text]
+    if boxes:
+        adjust_widths_by_letter(boxes)
+    return boxes
+
+
+def placed(boxes):
+    """Everything layout() decides about boxes."""
+    return [(b.x, b.y, b.w, b.stretchy, b.letter) for b in boxes]
+
+
+def placed_items(items):
+    """Like placed(), for laid out items: a box per letter, and the
+    hyphens at the end, like layout() adds them."""
+    boxes = []
+    hyphens = []
+    for item in items:
+        if isinstance(item, Word):
+            boxes.extend(
+                (item.x + o, item.y, w, False, l)
+                for o, w, l in zip(item.offsets, item.widths, item.letter)
+            )
+        elif isinstance(item, Hyphen):
+            hyphens.append((item.x, item.y, item.w, False, item.letter))
+        else:
+            boxes.append(
+                (item.x, item.y, item.w, item.stretchy, item.letter)
+            )
+    return boxes + hyphens
+
+
+def array_boxes(text):
+    """Like text_boxes(), in a BoxArray."""
+    text = insert_soft_hyphens(text)
+    return BoxArray.from_advances(text, advances(text))
+
+
+def ways(algorithm, lookback, jobs):
+    """The ways to lay out text that must agree with layout().
+
+    Yields a name, and a function that takes text, page size and
+    separation, and returns the laid out boxes.
+    """
+
+    def with_jobs(jobs):
+        def lay_out(text, page_size, separation):
+            boxes = text_boxes(text)
+            layout(
+                boxes,
+                create_pages(page_size),
+                separation,
+                algorithm,
+                lookback,
+                jobs=jobs,
+            )
+            return boxes
+
+        return lay_out
+
+    def as_document(text, page_size, separation):
+        return Document(
+            text, page_size, separation, algorithm, lookback
+        ).boxes
+
+    yield 'jobs=1', with_jobs(1)
+    yield 'jobs=%d' % jobs, with_jobs(jobs)
+    yield 'document', as_document
+
+
+def check(text, page_size=(30, 50), separation=0.05, lookback=4, jobs=2):
+    """Lay out text every way, and compare it to layout().
+
+    Returns a list of (algorithm, lookback, way, boxes placed
+    differently), one for each time something went wrong.
+    """
+    wrong = check_numpy(text, page_size, separation)
+    wrong += check_items(text, page_size, separation)
+    settings = [('greedy', k) for k in range(1, lookback + 1)]
+    settings.append(('total-fit', 1))
+    for algorithm, k in settings:
+        boxes = text_boxes(text)
+        layout(boxes, create_pages(page_size), separation, algorithm, k)
+        expected = placed(boxes)
+        for way, lay_out in ways(algorithm, k, jobs):
+            got = placed(lay_out(text, page_size, separation))
+            if got != expected:
+                different = sum(a != b for a, b in zip(got, expected))
+                different += abs(len(got) - len(expected))
+                wrong.append((algorithm, k, way, different))
+    return wrong
+
+
+def check_numpy(text, page_size, separation, tolerance=1e-6):
+    """Compare numpy_layout.layout_arrays() to greedy layout().
+
+    They round differently, so positions and widths only have to be
+    within tolerance, but the same boxes must go on the same pages.
+
+    Returns a list like check() does.
+    """
+    boxes = text_boxes(text)
+    pages = create_pages(page_size)
+    layout(boxes, pages, separation)
+    array = array_boxes(text)
+    array_pages = create_pages(page_size)
+    if len(array):
+        layout_arrays(array, array_pages, separation)
+    return _compare(
+        'numpy',
+        placed(boxes),
+        pages,
+        placed(array),
+        array_pages,
+        tolerance,
+    )
+
+
+def check_items(text, page_size, separation, tolerance=1e-6):
+    """Compare items.layout_items() to greedy layout(), like
+    check_numpy() does."""
+    boxes = text_boxes(text)
+    pages = create_pages(page_size)
+    layout(boxes, pages, separation)
+    items = create_items(text, separation)
+    item_pages = create_pages(page_size)
+    layout(items, item_pages, separation)
+    return _compare(
+        'items',
+        placed(boxes),
+        pages,
+        placed_items(items),
+        item_pages,
+        tolerance,
+    )
+
+
+def _compare(way, expected, pages, got, got_pages, tolerance):
+    """Boxes placed differently by way, as a list like check() returns."""
+    different = abs(len(got) - len(expected))
+    for a, b in zip(got, expected):
+        if a[3:] != b[3:] or any(
+            abs(u - v) > tolerance for u, v in zip(a[:3], b[:3])
+        ):
+            different += 1
+    if different or len(pages) != len(got_pages):
+        return [('greedy', 1, way, different)]
+    return []
+
+
+if __name__ == '__main__':
+    arguments = docopt(__doc__)
+    page_size = [int(x) for x in arguments['--page-size'].split('x')]
+    if arguments['<input>']:
+        with open(arguments['<input>']) as f:
+            texts = {arguments['<input>']: f.read()}
+    else:
+        size = int(arguments['--size'])
+        texts = {'prose': PROSE * (size // len(PROSE) + 1)}
+        texts.update(STARTS)
+        texts.update((name, case(size)) for name, case in CASES.items())
+    failed = []
+    for name, text in texts.items():
+        wrong = check(
+            text,
+            page_size,
+            float(arguments['--separation']),
+            int(arguments['--lookback']),
+            int(arguments['--jobs']),
+        )
+        for algorithm, k, way, different in wrong:
+            print(
+                '%-18s%-10s lookback %d, %-9s %d boxes differ'
+                % (name, algorithm, k, way, different)
+            )
+        print('%-18s%s' % (name, 'different' if wrong else 'ok'))
+        if wrong:
+            failed.append(name)
+    assert not failed, 'Different layouts: %s' % failed
+    print('All the same')
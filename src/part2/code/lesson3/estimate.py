@@ -0,0 +1,88 @@
+"""Estimate how many pages a text takes, laying out only some of it."""
+
+import random
+from math import ceil, floor, sqrt
+from statistics import NormalDist
+
+from document import Paragraph
+
+
+def estimate_pages(
+    text,
+    page_size=(30, 50),
+    separation=0.05,
+    sample=200,
+    confidence=0.95,
+    seed=0,
+    context=None,
+):
+    """Estimate the pages layout() would take for text.
+
+    Only a random sample of paragraphs (lines) is hyphenated, shaped
+    and broken into rows. Every paragraph takes one row, plus more
+    the longer it is, so we estimate how many extra rows each letter
+    takes from the sample, and use the length of all paragraphs,
+    which we know without laying them out.
+
+    Rows are the same height, so that gives pages. Paragraphs are
+    shaped with context, a fonts.FontContext.
+
+    Returns a dict with the estimated pages and rows, the low and high
+    ends of the confidence interval for pages, and how full the
+    sample's justified rows are before justifying them.
+    """
+    width, height = page_size
+    lines = text.splitlines(keepends=True)
+    n = len(lines)
+    if n == 0:
+        return {'pages': 0, 'low': 0, 'high': 0, 'rows': 0}
+    lengths = [len(line) for line in lines]
+    sampled = random.Random(seed).sample(range(n), min(sample, n))
+
+    # For each sampled paragraph: its length and its rows past the 1st
+    sizes = []
+    extras = []
+    fill = []
+    row_height = None
+    for k in sampled:
+        paragraph = Paragraph(lines[k], True, context=context)
+        natural = [b.w for b in paragraph.boxes]
+        paragraph.break_rows(width, separation, 'greedy', 1)
+        sizes.append(lengths[k])
+        extras.append(len(paragraph.rows) - 1)
+        row_height = paragraph.boxes[0].h
+        for row in paragraph.rows[:-1]:
+            # Everything but the last row is justified
+            used = sum(natural[row.start : row.end]) + separation * (
+                row.end - row.start - 1
+            )
+            fill.append(used / width)
+
+    # Ratio estimator: extra rows per letter, and its error
+    ratio = sum(extras) / max(sum(sizes), 1)
+    m = len(sampled)
+    rows = n + ratio * sum(lengths)
+    residuals = [e - ratio * s for e, s in zip(extras, sizes)]
+    if m > 1:
+        variance = sum(r * r for r in residuals) / (m - 1)
+    else:
+        variance = 0
+    error = n * sqrt(variance / m * (1 - m / n))
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    # A page holds its 1st row, and one more for each row height
+    # plus separation left
+    per_page = floor((height - row_height) / (row_height + separation)) + 1
+
+    def pages(rows):
+        return max(ceil(rows / per_page), 1)
+
+    return {
+        'pages': pages(rows),
+        'low': pages(rows - z * error),
+        'high': pages(rows + z * error),
+        'confidence': confidence,
+        'rows': round(rows),
+        'row_fill': sum(fill) / len(fill) if fill else None,
+        'sampled': m,
+    }
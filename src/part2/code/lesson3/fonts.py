@@ -1,18 +1,113 @@
+import threading
+
 import harfbuzz as hb
 import freetype2 as ft
 
+# The font all text is shaped with
+FONT = 'Arial'
+
+# Texts up to this long are shaped in a buffer that's kept and reused.
+# Longer ones get a buffer of their own, which is dropped once they are
+# shaped, since clearing a buffer doesn't free its glyphs' memory.
+REUSED_BUFFER_SIZE = 4096
+
+
+class FontContext():
+    """A font, loaded once, and what's needed to shape text with it.
+
+    Finding the face and making a HarfBuzz font takes longer than
+    shaping a word, so we make a FontContext once, and pass it to
+    everything that shapes text. Advances of single letters, like the
+    hyphen's, are remembered.
+
+    Shaping doesn't change the font, so a FontContext can be shared by
+    threads: each one gets its own buffer, for short texts. Processes
+    can't share one: sending it to another process makes a new one
+    there, for the same font. They can do that before they start
+    working (see preload).
+    """
+
+    def __init__(self, font=FONT, size=1):
+        self.font_name = font
+        self.size = size
+        font_lib = ft.get_default_lib()
+        self.face = font_lib.find_face(font)
+        self.face.set_char_size(size=size, resolution=64)
+        self.font = hb.Font.ft_create(self.face)
+        self._local = threading.local()
+        self._letters = {}
+
+    def __reduce__(self):
+        # The face and the HarfBuzz font can't be pickled, so we only
+        # send what's needed to load them again.
+        return FontContext, (self.font_name, self.size)
+
+    def buffer(self, size=0):
+        """An empty buffer for size letters, reused by each thread if
+        it's not too big (see REUSED_BUFFER_SIZE)."""
+        if size > REUSED_BUFFER_SIZE:
+            return hb.Buffer.create()
+        buf = getattr(self._local, 'buffer', None)
+        if buf is None:
+            buf = self._local.buffer = hb.Buffer.create()
+        else:
+            buf.clear_contents()
+        return buf
+
+    def advances(self, text):
+        """Shape text, and return the advance (width) of each glyph."""
+        buf = self.buffer(len(text))
+        buf.add_str(text)
+        buf.guess_segment_properties()
+        hb.shape(self.font, buf)
+        # at this point buf.glyph_positions has all the data we need
+        return [position.x_advance for position in buf.glyph_positions]
+
+    def advance(self, letter):
+        """The advance of a single letter, shaped only the first time."""
+        try:
+            return self._letters[letter]
+        except KeyError:
+            advance = self._letters[letter] = self.advances(letter)[0]
+            return advance
 
-def adjust_widths_by_letter(boxes):
+
+# The FontContext used when none is given
+_default = None
+
+
+def default_context():
+    """This process's FontContext for FONT, made the first time."""
+    global _default
+    if _default is None:
+        _default = FontContext()
+    return _default
+
+
+def preload(context=None):
+    """Make context this process's default FontContext, or make one
+    for FONT now.
+
+    Use it as a process pool's initializer, with a FontContext as its
+    argument, so each worker loads that font once, before its first
+    job, and uses it when not given a FontContext.
+    """
+    global _default
+    _default = context or FontContext()
+
+
+def adjust_widths_by_letter(boxes, context=None):
     """Takes a list of boxes as arguments, and uses harfbuzz to
     adjust the width of each box to match the harfbuzz text shaping."""
-    buf = hb.Buffer.create()
-    buf.add_str(''.join(b.letter for b in boxes))
-    buf.guess_segment_properties()
-    font_lib = ft.get_default_lib()
-    face = font_lib.find_face('Arial')
-    face.set_char_size(size=1, resolution=64)
-    font = hb.Font.ft_create(face)
-    hb.shape(font, buf)
-    # at this point buf.glyph_positions has all the data we need
-    for box, position in zip(boxes, buf.glyph_positions):
-        box.w = position.x_advance
+    for box, advance in zip(
+        boxes, advances(''.join(b.letter for b in boxes), context)
+    ):
+        box.w = advance
+
+
+def advances(text, context=None):
+    """Uses harfbuzz to shape text, and returns the advance (width)
+    of each glyph.
+
+    The font is context's, or the default_context()."""
+    return (context or default_context()).advances(text)
@@ -1,6 +1,9 @@
 import pyphen
 
-dic = pyphen.Pyphen(lang='en_US')
+# The language hyphenation follows
+LANGUAGE = 'en_US'
+
+dic = pyphen.Pyphen(lang=LANGUAGE)
 
 
 def insert_soft_hyphens(text, hyphen='\xad'):
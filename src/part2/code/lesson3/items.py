@@ -0,0 +1,382 @@
+"""Text as words, glue and penalties, instead of a box per letter."""
+
+from bisect import bisect_right
+
+from fonts import advances, default_context
+from hyphen import insert_soft_hyphens
+
+
+class Item():
+    """Something laid out: it has a position and size, like a Box."""
+
+    stretchy = False
+    letter = ''
+
+    def __init__(self, x=0, y=0, w=0, h=1):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+    def __repr__(self):
+        return '%s(%s, %s, %s, %s, "%s")' % (
+            type(self).__name__, self.x, self.y, self.w, self.h,
+            self.letter,
+        )
+
+
+class Word(Item):
+    """A whole word, or the part of one between hyphenation points, as
+    one box.
+
+    offsets are where each of its letters goes, from the word's x, and
+    widths are how wide each one is.
+    """
+
+    def __init__(self, text, offsets, widths, h=1):
+        super().__init__(w=offsets[-1] + widths[-1], h=h)
+        self.letter = text
+        self.offsets = offsets
+        self.widths = widths
+
+    def piece(self, start, end):
+        """The letters from start to end, as a word of their own."""
+        base = self.offsets[start]
+        return Word(
+            self.letter[start:end],
+            [o - base for o in self.offsets[start:end]],
+            self.widths[start:end],
+            h=self.h,
+        )
+
+
+class Glue(Item):
+    """A space, that can get wider by stretch to justify rows."""
+
+    stretchy = True
+    letter = ' '
+
+    def __init__(self, w, stretch, h=1):
+        super().__init__(w=w, h=h)
+        self.stretch = stretch
+
+
+class Penalty(Item):
+    """A place where rows can break.
+
+    A forced one is a newline, that always breaks them. The others are
+    hyphenation points, where breaking adds a hyphen. Either is w wide
+    if it's not broken, like the box layout() gets for its letter.
+    """
+
+    def __init__(self, w=0, forced=False, h=1):
+        super().__init__(w=w, h=h)
+        self.forced = forced
+        self.letter = '\n' if forced else '\xad'
+
+
+class Hyphen(Item):
+    """The hyphen added at the end of a row broken at a Penalty."""
+
+    letter = '-'
+
+
+def create_items(text, separation=0.05, context=None):
+    """Hyphenate and shape text, into words, glue and penalties.
+
+    Letters in a word are separated by separation, like boxes are
+    by layout(), so it must be the same given to layout(). They are
+    shaped with context, a fonts.FontContext.
+    """
+    text = insert_soft_hyphens(text)
+    items = []
+    letters = []
+    widths = []
+
+    def end_word():
+        if letters:
+            offsets = []
+            x = 0
+            for w in widths:
+                offsets.append(x)
+                x += w + separation
+            items.append(Word(''.join(letters), offsets, widths[:]))
+        del letters[:], widths[:]
+
+    for letter, width in zip(text, advances(text, context)):
+        if letter == '\xad':
+            end_word()
+            items.append(Penalty(width))
+        elif letter == ' ':
+            end_word()
+            items.append(Glue(width, width))
+        elif letter == '\n':
+            end_word()
+            items.append(Penalty(width, forced=True))
+        else:
+            letters.append(letter)
+            widths.append(width)
+    end_word()
+    return items
+
+
+def layout_items(items, pages, separation, context=None):
+    """Layout items along pages, like layout() does with boxes.
+
+    Rows are broken like greedy layout() breaks them: at the first
+    glue or hyphenation point that goes past the right margin, so the
+    row before it may go past it a little, and is squeezed. Rows are
+    broken at a word's letter only in an emergency (see
+    boxes.place_rows). Full rows are justified by stretching their
+    glue. The items are replaced by those laid out: broken words become
+    several, and hyphens are added.
+
+    Where a word reaches the margin is found by bisecting its letters,
+    so this takes linear time even for text without spaces.
+
+    Returns the index of the last page used.
+    """
+    if not items:
+        return 0
+    hyphen_width = (context or default_context()).advance('-')
+    s = separation
+    placed = []
+    page = 0
+    frame = pages[page]
+    # Like layout(), each row is laid out starting at x=0, and moved to
+    # its page once it's done
+    y = frame.y
+    # The items in the row that get justified, and its glue
+    row = []
+    stretchies = []
+    # Where the row starts in placed
+    row_mark = 0
+    # How many letters of row[0] are not in the row: layout() leaves
+    # the very first box out of it
+    skip = 0
+    # Are all the items in the row collapsed glue?
+    leading = True
+    # Where could we break the row last, if it comes to an emergency,
+    # as (item, and how long placed, row and stretchies were before it)
+    last_break = None
+    # And how wide is its glue, once it's past the margin?
+    room = None
+
+    def break_row(item, hyphen=False, justify=True):
+        """End the row, to start a new one with item."""
+        nonlocal page, frame, y, row_mark, skip, leading, last_break, room
+        previous = placed[-1]
+        if hyphen:
+            h_b = Hyphen(previous.x + previous.w + s, y, hyphen_width)
+            placed.append(h_b)
+            row.append(h_b)
+        if justify:
+            justify_items(row, stretchies, frame.w, s, skip)
+        # Move the row to its page
+        if frame.x:
+            for done in placed[row_mark:]:
+                done.x += frame.x
+        row_mark = len(placed)
+        # We go a little down
+        y = previous.y + previous.h + s
+        # But if we go too far down
+        if y + item.h > frame.y + frame.h:
+            # We go to the next page
+            page += 1
+            frame = pages[page]
+            y = frame.y
+        row.clear()
+        stretchies.clear()
+        skip = 0
+        leading = True
+        last_break = room = None
+
+    def put(item, x, in_row=True):
+        item.x, item.y = x, y
+        placed.append(item)
+        if in_row:
+            row.append(item)
+
+    def rewind(to):
+        """Take the items after last_break out of the row, to break
+        there instead."""
+        nonlocal i, start, starts_row, forced
+        i, in_placed, in_row, in_stretchies = to
+        del placed[in_placed:], row[in_row:], stretchies[in_stretchies:]
+        start, starts_row, forced = 0, False, True
+
+    i = start = 0
+    # Does items[i] (from letter start, if it's a word) start a row?
+    starts_row = True
+    # Did an emergency choose to break at items[i]?
+    forced = False
+    while i < len(items):
+        item = items[i]
+        x = 0 if starts_row else placed[-1].x + placed[-1].w + s
+        if not (starts_row or leading or forced):
+            # Most words and glue just go in the row
+            if isinstance(item, Word):
+                if x + item.w <= frame.w:
+                    item.x, item.y = x, y
+                    placed.append(item)
+                    row.append(item)
+                    i += 1
+                    continue
+            elif isinstance(item, Glue):
+                if x + item.w <= frame.w:
+                    last_break = (i, len(placed), len(row), len(stretchies))
+                    item.x, item.y = x, y
+                    placed.append(item)
+                    row.append(item)
+                    stretchies.append(item)
+                    i += 1
+                    continue
+        first = i == 0 and start == 0
+        if first and not isinstance(item, Word):
+            # The 1st box is not in any row
+            put(item, 0, False)
+            starts_row = False
+            i += 1
+            continue
+
+        if isinstance(item, Penalty) and item.forced:
+            # Newlines take no horizontal space ever, and the end of a
+            # paragraph is not justified
+            item.w = 0
+            break_row(item, justify=False)
+            put(item, 0)
+            leading = False
+        elif isinstance(item, Glue):
+            if forced or x + item.w > frame.w:
+                break_row(item)
+                x = 0
+            put(item, x)
+            if leading:
+                # Collapse all left-margin space
+                item.w = 0
+                item.stretchy = False
+                item.x = 0
+            else:
+                last_break = (
+                    i, len(placed) - 1, len(row) - 1, len(stretchies)
+                )
+                stretchies.append(item)
+        elif isinstance(item, Penalty):
+            past = x + item.w > frame.w
+            if past and not leading and not forced:
+                if room is None:
+                    room = sum(g.w for g in stretchies)
+                # A row broken here ends with a hyphen
+                if x + hyphen_width > frame.w + room + 1e-6:
+                    if last_break is not None:
+                        rewind(last_break)
+                        continue
+            if forced or past:
+                break_row(item, hyphen=True)
+                put(item, 0)
+            else:
+                last_break = (i, len(placed), len(row), len(stretchies))
+                put(item, x)
+            leading = False
+        else:
+            # We put the word, or as much of it as fits, in the row
+            n = len(item.letter)
+            # Letters are checked for an emergency, except one starting
+            # a row, or the first after collapsed glue
+            c = start
+            if starts_row:
+                c += 1
+                if not first:
+                    leading = False
+            if leading and c < n:
+                c += 1
+                leading = False
+            # Where the word's letters are in the row
+            shift = x - item.offsets[start]
+            k = n
+            if c < n and item.offsets[-1] + item.widths[-1] + shift > (
+                frame.w
+            ):
+                if room is None:
+                    room = sum(g.w for g in stretchies)
+                # The first letter that ends too far
+                k = bisect_right(
+                    range(n),
+                    frame.w + room + 1e-6,
+                    c,
+                    key=lambda j: item.offsets[j] + item.widths[j] + shift,
+                )
+            if k < n and last_break is not None:
+                # It's better broken where the row could break
+                rewind(last_break)
+                continue
+            if k > start:
+                piece = item if (start, k) == (0, n) else item.piece(start, k)
+                # Only the letters after the 1st box are in the row
+                put(piece, x, not first or k > 1)
+                if first:
+                    skip = 1
+            if k < n:
+                # Nothing can squeeze it into the row, so it's broken
+                # right there (an emergency break)
+                break_row(item)
+                start, starts_row, forced = k, True, False
+                continue
+        i += 1
+        start = 0
+        starts_row = forced = False
+
+    # Move the last row to its page
+    if frame.x:
+        for done in placed[row_mark:]:
+            done.x += frame.x
+    items[:] = placed
+    return page
+
+
+def justify_items(row, stretchies, right, separation, skip=0):
+    """Make the row reach right, stretching its glue.
+
+    Like boxes.justify_row(), if nothing stretches each letter moves a
+    little more than the one before. The first skip letters of row[0]
+    are not in the row, and don't move.
+    """
+    # Right-margin glue is not part of the row, and collapses at the
+    # margin, so it's not left behind the last word when that moves
+    while row and isinstance(row[-1], Glue):
+        glue = row.pop()
+        if glue.stretchy:
+            stretchies.pop()
+        glue.x, glue.w = right, 0
+    if not row:
+        return
+    slack = right - (row[-1].x + row[-1].w)
+    if not stretchies:
+        count = sum(
+            len(i.letter) if isinstance(i, Word) else 1 for i in row
+        )
+        bump = slack / (count - skip)
+        # The row index of each item's first letter
+        k = -skip
+        for item in row:
+            if isinstance(item, Word):
+                moved = [
+                    o + bump * max(k + j, 0)
+                    for j, o in enumerate(item.offsets)
+                ]
+                item.x += moved[0]
+                item.offsets = [o - moved[0] for o in moved]
+                item.w = item.offsets[-1] + item.widths[-1]
+                k += len(item.letter)
+            else:
+                item.x += bump * k
+                k += 1
+        return
+    stretch = sum(g.stretch for g in stretchies)
+    for glue in stretchies:
+        glue.w += slack * (
+            glue.stretch / stretch if stretch else 1 / len(stretchies)
+        )
+    # And we put each thing next to the previous one
+    for j in range(1, len(row)):
+        row[j].x = row[j - 1].x + row[j - 1].w + separation
@@ -0,0 +1,467 @@
+"""Greedy layout of a BoxArray, using numpy instead of a loop per box."""
+
+from bisect import bisect_right
+
+import numpy as np
+
+from boxarray import STRETCHY, BoxArray
+from fonts import default_context
+
+
+def layout_arrays(boxes, pages, separation, context=None):
+    """Layout a BoxArray along pages, like layout() does.
+
+    The result is the same as layout(boxes, pages, separation) except
+    for rounding, but instead of looking at each box it only does a
+    little work per row, and the rest with numpy.
+
+    Like layout(), this modifies the boxes, and removes leftover pages.
+    Use break_arrays() to leave the boxes alone.
+    """
+    if len(boxes) == 0:
+        return
+    rows = break_arrays(boxes, pages, separation, context)
+    rows.apply()
+    # Remove leftover boxes
+    del (pages[rows.page[-1]:])
+
+
+def break_arrays(boxes, pages, separation, context=None):
+    """Break a BoxArray into rows, and put them on pages.
+
+    Nothing is modified: this returns a RowTable, that knows where
+    each row goes, and can tell where its boxes go when asked.
+    Hyphens are as wide as context, a fonts.FontContext, says.
+    """
+    n = len(boxes)
+    s = separation
+    if n == 0:
+        return _no_rows(boxes, separation, context)
+    letters = boxes.codepoints[:n]
+    w = boxes.w[:n]
+    h = boxes.h[:n]
+    idx = np.arange(n)
+
+    # Newlines take no horizontal space ever (layout() never looks at
+    # the 1st box, so it keeps its width)
+    newlines = letters == ord('\n')
+    newlines[0] = False
+    # For each box, the next newline, the next place where we
+    # could break a row, and the 1st box from there that's not a space
+    next_newline = np.where(newlines, idx, n)
+    next_newline[:-1] = next_newline[1:]
+    next_newline[-1] = n
+    next_newline = np.minimum.accumulate(next_newline[::-1])[::-1]
+    is_break = (letters == ord(' ')) | (letters == ord('\xad'))
+    breaks = np.flatnonzero(is_break)
+    # (as an index in breaks)
+    next_break = np.append(np.cumsum(is_break), len(breaks))
+    next_word = np.where(letters != ord(' '), idx, n)
+    next_word = np.minimum.accumulate(next_word[::-1])[::-1]
+    words = np.flatnonzero(letters != ord(' '))
+    # If all boxes in a row are placed one after the other, box k is
+    # placed at left[k] minus left[first box], plus where the first is.
+    left, stretchies = running_totals(boxes, s)
+    # And the right side of each break is at this, measured the same way.
+    # We search in it once per row, so a list is faster.
+    breaks_right = (left[breaks] + w[breaks]).tolist()
+    # The right side of every box, for emergency breaks (see
+    # boxes.place_rows), which can happen at any box.
+    boxes_right = left[:n] + np.where(newlines, 0, w)
+    # And how wide the stretchy boxes before each box are, measured
+    # the same way, since that's how far past the margin a row can go
+    # before an emergency break.
+    stretchy = ((boxes.flags[:n] & STRETCHY) > 0) & ~newlines
+    stretchy_left = np.zeros(n + 1)
+    np.cumsum(np.where(stretchy, w, 0), out=stretchy_left[1:])
+    hyphen_width = (context or default_context()).advance('-')
+
+    # What we find out about each row, one row at a time
+    starts = []  # 1st box in the row
+    firsts = []  # 1st box that is not a collapsed space
+    first_xs = []  # where that box goes
+    ends = []  # the box that starts the next row
+    full = []  # was it broken because it's full?
+    row_pages = []
+    ys = []
+    page = 0
+    y = pages[page].y
+    # The 1st box is not part of its row, just placed at the top-left
+    start = 1
+    if n > 1 and letters[1] == ord(' '):
+        # Collapse all left-margin space
+        first, offset = next_word.item(1), s
+    else:
+        first, offset = 0, 0
+    while True:
+        # Like layout(), we measure rows from x=0, not from the page
+        too_far = left.item(first) + pages[page].w - offset
+        # The 1st row really starts at the 1st box, so a newline right
+        # after it ends that row.
+        newline = next_newline.item(start if starts else 0)
+        # The 1st break after the 1st box that is too far to the right
+        j = bisect_right(breaks_right, too_far, next_break.item(first))
+        end = breaks.item(j) if j < len(breaks) else n
+        if end > newline:
+            end = newline
+        # An emergency break, if the row goes further past the margin
+        # than its spaces are wide, before it gets to end. Until then
+        # it gets no more spaces, so we measure them at the 1st box
+        # past the margin.
+        anchor = max(first, start)
+        k = anchor + 1 + np.searchsorted(
+            boxes_right[anchor + 1 :], too_far, 'right'
+        )
+        if k <= end:
+            # (with the same leeway for rounding as layout())
+            limit = (
+                too_far
+                + stretchy_left.item(k)
+                - stretchy_left.item(anchor)
+                + 1e-6
+            )
+            k += np.searchsorted(boxes_right[k:end], limit, 'right')
+            if k == end and (
+                end == n
+                or letters.item(end) != ord('\xad')
+                or left.item(end) + hyphen_width <= limit
+            ):
+                # No emergency, unless the hyphen goes too far
+                k = n
+            if k < n:
+                # Break at the last place we could, if any
+                b = np.searchsorted(breaks, k) - 1
+                if (
+                    b >= 0
+                    and breaks.item(b) >= anchor
+                    and breaks.item(b) > (start if starts else 0)
+                ):
+                    end = breaks.item(b)
+                else:
+                    end = k
+        starts.append(start)
+        firsts.append(first)
+        first_xs.append(pages[page].x + offset)
+        ends.append(end)
+        full.append(end < newline)
+        row_pages.append(page)
+        ys.append(y)
+        if end >= n:
+            break
+
+        # We go all the way left and a little down
+        y = y + h.item(end - 1) + s
+        # But if we go too far down
+        if y + h.item(end) > pages[page].y + pages[page].h:
+            # We go to the next page
+            page += 1
+            y = pages[page].y
+        start = end
+        if letters.item(end) == ord(' '):
+            first, offset = next_word.item(end), s
+        else:
+            first, offset = end, 0
+
+    rows = RowTable(boxes, separation, context)
+    rows.start = starts = np.array(starts)
+    rows.first = firsts = np.array(firsts)
+    rows.first_x = first_xs = np.array(first_xs)
+    rows.end = ends = np.array(ends)
+    rows.y = np.array(ys)
+    rows.page = np.array(row_pages)
+    rows.origin = origin = np.array(
+        [p.x for p in pages[: page + 1]]
+    )[row_pages]
+    width = np.array([p.w for p in pages[: page + 1]])[row_pages]
+    rows.pages_x = pages[0].x
+    full = np.array(full)
+    # Rows broken at a soft hyphen get a hyphen at the end, the rest
+    # lose their right-margin spaces.
+    rows.hyphen = hyphen = full & (
+        letters[np.minimum(ends, n - 1)] == ord('\xad')
+    )
+    rows.last = last = np.where(
+        hyphen,
+        ends - 1,
+        np.append(-1, words)[np.searchsorted(words, ends)],
+    )
+
+    # Collapsed spaces are not stretchy, but they are always before a
+    # row's anchor, the 1st box after them, so they are never counted
+    # in stretchies.
+    rows.stretchies = stretchies
+    anchor = np.maximum(firsts, starts)
+
+    # Each box goes after the 1st box in its row, unless the row was
+    # full. Then, stretchy boxes in it get wider by bump, to make it
+    # reach the right margin, and the rest moves after them.
+    base = first_xs - left[firsts]
+    row_right = (
+        base + left[last] + w[last] + hyphen * (s + rows.hyphen_width)
+    )
+    rows.slack = slack = origin + width - row_right
+    rows.full = full = full & (last >= starts)
+    count = stretchies[last + 1] - stretchies[anchor]
+    rows.stretched = stretched = full & (count > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rows.bump = bump = np.where(stretched, slack / count, 0)
+    # The 1st box in the row stays where it is
+    row_x = np.where(firsts > starts, origin, base + left[starts])
+    rows.base = np.where(
+        stretched,
+        row_x
+        + (anchor - starts) * s
+        - left[anchor]
+        - bump * stretchies[anchor],
+        base,
+    )
+    # Full rows with nothing stretchy: each box moves a little
+    squeezed = full & (count == 0)
+    rows.nudge = np.zeros(len(starts))
+    rows.nudge[squeezed] = slack[squeezed] / (
+        last[squeezed] + 1 - starts[squeezed] + hyphen[squeezed]
+    )
+    rows.left = left
+    return rows
+
+
+def _no_rows(boxes, separation, context=None):
+    """The RowTable for no boxes: it has no rows, on no pages."""
+    rows = RowTable(boxes, separation, context)
+    for name in 'start', 'first', 'end', 'last', 'page':
+        setattr(rows, name, np.zeros(0, np.int64))
+    for name in 'first_x', 'y', 'origin', 'slack', 'bump', 'base', 'nudge':
+        setattr(rows, name, np.zeros(0))
+    for name in 'full', 'hyphen', 'stretched':
+        setattr(rows, name, np.zeros(0, bool))
+    rows.pages_x = 0
+    rows.left, rows.stretchies = running_totals(boxes, separation)
+    return rows
+
+
+def running_totals(boxes, separation):
+    """Running totals over a BoxArray, that break_arrays() uses.
+
+    Returns two arrays, with an item for each box and one more:
+
+    * left: where each box goes if all of them are put one after the
+      other from 0, with newlines taking no space.
+    * stretchies: how many stretchy boxes, not counting newlines,
+      there are before each box.
+    """
+    n = len(boxes)
+    w = boxes.w[:n]
+    stretchy = (boxes.flags[:n] & STRETCHY) > 0
+    # Newlines take no horizontal space ever (layout() never looks at
+    # the 1st box, so it keeps its width)
+    newlines = boxes.codepoints[:n] == ord('\n')
+    newlines[:1] = False
+    left = np.zeros(n + 1)
+    np.cumsum(np.where(newlines, 0, w) + separation, out=left[1:])
+    stretchies = np.zeros(n + 1)
+    np.cumsum(stretchy & ~newlines, out=stretchies[1:])
+    return left, stretchies
+
+
+class RowTable():
+    """Where each row of a BoxArray goes, as returned by break_arrays().
+
+    For each row we only keep a few numbers, in arrays with one item
+    per row:
+
+    * start, end: the row is made of boxes[start:end]
+    * first: the 1st box that is not a collapsed left-margin space
+    * first_x: where that box goes
+    * last: the last box before the right-margin spaces
+    * page, y, origin: the page where the row goes, how far down, and
+      where that page's left margin is
+    * hyphen: does the row end with a visible hyphen?
+    * bump, stretched: how much wider each stretchy box in the row gets
+    * full: was the row broken because it was full? (if not, it's not
+      justified)
+    * slack: how much space the row's boxes leave at its right,
+      before justifying it (negative if they don't fit)
+    * nudge: how much each box moves, if the row is full and nothing in
+      it is stretchy
+    * base: where the box at left == 0 would go
+
+    Boxes keep their natural widths. Positions (and justified widths)
+    are worked out only when asked for, for the rows that are asked for.
+    """
+
+    def __init__(self, boxes, separation, context=None):
+        self.boxes = boxes
+        self.separation = separation
+        self.hyphen_width = (context or default_context()).advance('-')
+
+    def __len__(self):
+        return len(self.start)
+
+    def detach(self):
+        """Forget the boxes, and the running totals over them.
+
+        Those take memory for each box, while the rest only takes some
+        for each row, so this makes the table quick to send to another
+        process. Use attach() to use it again.
+        """
+        self.boxes = self.left = self.stretchies = None
+
+    def attach(self, boxes, totals=None):
+        """Use the table again with boxes, after detach().
+
+        totals are running_totals() over the boxes, with the same
+        separation, if they were already worked out.
+
+        Returns the totals.
+        """
+        if totals is None:
+            totals = running_totals(boxes, self.separation)
+        self.boxes = boxes
+        self.left, self.stretchies = totals
+        return totals
+
+    def pages(self):
+        """How many pages the rows are on."""
+        return self.page.item(-1) + 1 if len(self) else 0
+
+    def page_rows(self, first, last=None):
+        """The rows on pages first to last (or just on page first).
+
+        Returns them as a range.
+        """
+        if last is None:
+            last = first
+        return range(
+            np.searchsorted(self.page, first, 'left'),
+            np.searchsorted(self.page, last, 'right'),
+        )
+
+    def positions(self, rows=None):
+        """Where the boxes in rows go, and how wide they are.
+
+        rows is a range of rows, all of them by default.
+
+        Returns the index of the 1st box, and arrays x, y, w and
+        stretchy for that box and those after it, and also x and y for
+        the hyphen of each row in rows that has one, in order.
+        """
+        if rows is None:
+            rows = range(len(self))
+        s = self.separation
+        r0, r1 = rows.start, rows.stop
+        if r1 <= r0:
+            a = b = 0
+        else:
+            # The 1st box is part of no row, it goes with the 1st row
+            a = 0 if r0 == 0 else self.start.item(r0)
+            b = self.end.item(r1 - 1)
+        k = np.arange(a, b)
+        starts = self.start[r0:r1]
+        firsts = self.first[r0:r1]
+        row = np.repeat(
+            np.arange(r0, r1),
+            np.diff(np.concatenate(([a], self.end[r0:r1]))),
+        )
+        letters = self.boxes.codepoints[a:b]
+        w = self.boxes.w[a:b].copy()
+        stretchy = (self.boxes.flags[a:b] & STRETCHY) > 0
+        # Newlines take no horizontal space, and don't stretch
+        newlines = letters == ord('\n')
+        if a == 0 and b > 0:
+            newlines[0] = False
+        w[newlines] = 0
+        stretchy &= ~newlines
+        # Nor do collapsed spaces
+        collapsed = _ranges(b - a, starts - a, firsts - a)
+        w[collapsed] = 0
+        stretchy &= ~collapsed
+
+        bump = self.bump[row]
+        x = self.base[row] + self.left[k] + bump * self.stretchies[k]
+
+        # There are a few exceptions...
+        if a == 0 and b > 0:
+            x[0] = self.pages_x
+        # Collapsed spaces go at the left margin, but are spread out by
+        # the separation if the row was stretched.
+        c = np.flatnonzero(collapsed)
+        r = row[c]
+        x[c] = self.origin[r] + np.where(
+            self.stretched[r], (c + a - self.start[r]) * s, 0
+        )
+        # Right-margin spaces are not part of the row, so they don't move
+        trailing = _ranges(
+            b - a,
+            np.maximum(self.last[r0:r1] + 1, firsts) - a,
+            self.end[r0:r1] - a,
+        )
+        t = np.flatnonzero(trailing)
+        r = row[t]
+        x[t] = (
+            self.first_x[r] - self.left[self.first[r]] + self.left[t + a]
+        )
+        bumped = stretchy & ~trailing
+        if a == 0 and b > 0:
+            bumped[0] = False
+        w += bump * bumped
+        for r in np.flatnonzero(self.nudge[r0:r1]) + r0:
+            start, end = self.start.item(r), self.last.item(r) + 1
+            x[start - a : end - a] += self.nudge[r] * np.arange(
+                end - start
+            )
+
+        # And hyphens go after the last box in their row
+        hyphens = np.flatnonzero(self.hyphen[r0:r1]) + r0
+        last = self.last[hyphens] - a
+        hyphen_x = x[last] + w[last] + s + self.nudge[hyphens]
+        return a, x, self.y[row], w, stretchy, hyphen_x, self.y[hyphens]
+
+    def apply(self, rows=None):
+        """Move and widen the boxes in rows, and add their hyphens.
+
+        This is what layout() would have done to them.
+        """
+        a, x, y, w, stretchy, hyphen_x, hyphen_y = self.positions(rows)
+        b = a + len(x)
+        boxes = self.boxes
+        boxes.x[a:b] = x
+        boxes.y[a:b] = y
+        boxes.w[a:b] = w
+        boxes.flags[a:b] &= ~STRETCHY & 0xFF
+        boxes.flags[a:b] |= (stretchy * STRETCHY).astype(np.uint8)
+        boxes.reserve(len(hyphen_x))
+        for hx, hy in zip(hyphen_x.tolist(), hyphen_y.tolist()):
+            boxes.append_letter('-', hx, hy, self.hyphen_width)
+
+    def laid_out(self, rows=None):
+        """A new BoxArray with the boxes in rows, where they go.
+
+        Hyphens are added at the end, like layout() does. This doesn't
+        look at boxes in other rows, so it's cheap for a few pages.
+        """
+        a, x, y, w, stretchy, hyphen_x, hyphen_y = self.positions(rows)
+        b = a + len(x)
+        part = self.boxes[a:b]
+        result = BoxArray()
+        result._set_arrays(
+            x=x,
+            y=y,
+            w=w,
+            h=part.h.copy(),
+            flags=part.flags & (~STRETCHY & 0xFF)
+            | (stretchy * STRETCHY).astype(np.uint8),
+            codepoints=part.codepoints.copy(),
+        )
+        result.reserve(len(hyphen_x))
+        for hx, hy in zip(hyphen_x.tolist(), hyphen_y.tolist()):
+            result.append_letter('-', hx, hy, self.hyphen_width)
+        return result
+
+
+def _ranges(n, starts, ends):
+    """Which of n boxes are in one of the starts[i]:ends[i] ranges."""
+    keep = starts < ends
+    marks = np.zeros(n + 1, np.int64)
+    np.add.at(marks, starts[keep], 1)
+    np.add.at(marks, ends[keep], -1)
+    return np.cumsum(marks[:n]) > 0
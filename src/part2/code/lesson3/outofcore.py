@@ -0,0 +1,220 @@
+"""Lay out texts bigger than memory, keeping the boxes in files."""
+
+import json
+import os
+import resource
+
+import numpy as np
+
+from boxarray import FIELDS, NEWLINE, SOFT_HYPHEN, STRETCHY, BoxArray
+from boxes import Box
+from stream import draw_pages, iter_pages
+
+# The type of each of BoxArray's arrays, as they are saved
+DTYPES = {
+    'x': np.float64,
+    'y': np.float64,
+    'w': np.float64,
+    'h': np.float64,
+    'flags': np.uint8,
+    'codepoints': np.uint32,
+}
+
+
+class PageWindow():
+    """Pages like create_pages(page_size) makes, made when asked for.
+
+    Only the last page asked for is kept, so this takes the same memory
+    for any number of pages.
+    """
+
+    def __init__(self, page_size, gap=5):
+        self.page_size = page_size
+        self.gap = gap
+        self._last = None
+
+    def __getitem__(self, i):
+        if self._last is None or self._last[0] != i:
+            w, h = self.page_size
+            self._last = i, Box(i * (w + self.gap), 0, w, h)
+        return self._last[1]
+
+
+class BoxFiles():
+    """Laid out boxes, in files in directory, one per array of a
+    BoxArray, and where each page's boxes start.
+
+    Pages are added with add_page(), and kept in memory until there
+    are window of them. Then they are written at the end of the files.
+    Once closed, boxes() and page() read the files with numpy.memmap,
+    so only the parts used are loaded.
+    """
+
+    def __init__(self, directory, window=64):
+        self.directory = directory
+        self.window = window
+        self.size = 0
+        self.page_count = 0
+        self.settings = {}
+        self._pending = []
+        self._files = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def create(self, **settings):
+        """Start writing, replacing what was in directory."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._files = {
+            name: open(self._path(name), 'wb')
+            for name in FIELDS + ('pages',)
+        }
+        self.size = self.page_count = 0
+        self.settings = settings
+
+    def add_page(self, boxes):
+        """Add the boxes of the next page."""
+        self._pending.append(boxes)
+        if len(self._pending) >= self.window:
+            self.flush()
+
+    def flush(self):
+        """Write the pages kept in memory."""
+        starts = []
+        letters = []
+        x, y, w, h, stretchy = [], [], [], [], []
+        for boxes in self._pending:
+            starts.append(self.size + len(letters))
+            for b in boxes:
+                letters.append(b.letter)
+                x.append(b.x)
+                y.append(b.y)
+                w.append(b.w)
+                h.append(b.h)
+                stretchy.append(b.stretchy)
+        self._pending = []
+        codepoints = np.frombuffer(
+            ''.join(letters).encode('utf-32-le'), np.uint32
+        )
+        arrays = {
+            'x': x,
+            'y': y,
+            'w': w,
+            'h': h,
+            # Like BoxArray.letter_flags(), but spaces that were
+            # collapsed are not stretchy anymore.
+            'flags': np.array(stretchy, np.uint8) * STRETCHY
+            | (codepoints == ord('\n')) * NEWLINE
+            | (codepoints == ord('\xad')) * SOFT_HYPHEN,
+            'codepoints': codepoints,
+        }
+        for name in FIELDS:
+            np.asarray(arrays[name], DTYPES[name]).tofile(
+                self._files[name]
+            )
+        np.array(starts, np.uint64).tofile(self._files['pages'])
+        self.size += len(letters)
+        self.page_count += len(starts)
+
+    def close(self):
+        """Write what's left, and what's needed to read it back."""
+        self.flush()
+        for f in self._files.values():
+            f.close()
+        self._files = None
+        with open(self._path('layout.json'), 'w') as f:
+            json.dump(
+                dict(
+                    self.settings,
+                    boxes=self.size,
+                    pages=self.page_count,
+                ),
+                f,
+            )
+
+    def open(self):
+        """Read what a BoxFiles wrote in directory before."""
+        with open(self._path('layout.json')) as f:
+            self.settings = json.load(f)
+        self.size = self.settings.pop('boxes')
+        self.page_count = self.settings.pop('pages')
+        return self
+
+    def _memmap(self, name, dtype):
+        if os.path.getsize(self._path(name)) == 0:
+            # numpy can't map empty files
+            return np.zeros(0, dtype)
+        return np.memmap(self._path(name), dtype, mode='r')
+
+    def boxes(self):
+        """All the boxes, as a read-only BoxArray backed by the files."""
+        boxes = BoxArray()
+        boxes._set_arrays(
+            **{name: self._memmap(name, DTYPES[name]) for name in FIELDS}
+        )
+        return boxes
+
+    def page(self, i):
+        """The boxes on page i, counting from 0."""
+        starts = self._memmap('pages', np.uint64)
+        start = int(starts[i])
+        end = int(starts[i + 1]) if i + 1 < len(starts) else self.size
+        return self.boxes()[start:end]
+
+
+def peak_rss():
+    """The most memory this process has used so far, in bytes."""
+    # Linux gives it in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def layout_out_of_core(
+    input,
+    directory,
+    page_size=(30, 50),
+    separation=0.05,
+    algorithm='greedy',
+    lookback=1,
+    window=64,
+    context=None,
+):
+    """Lay out the text in input, saving the boxes in directory.
+
+    The text is read a line at a time, each line is laid out like
+    stream.iter_pages() does, and boxes are written to files every
+    window pages (see BoxFiles). So memory use depends on window and
+    on the longest line, but not on the size of the text. Lines are
+    shaped with context, a fonts.FontContext.
+
+    Returns the BoxFiles, and the peak memory use, in bytes.
+    """
+    files = BoxFiles(directory, window)
+    files.create(
+        page_size=list(page_size),
+        separation=separation,
+        algorithm=algorithm,
+        lookback=lookback,
+    )
+    with open(input) as f:
+        for page, boxes in iter_pages(
+            f,
+            PageWindow(page_size),
+            separation,
+            algorithm,
+            lookback,
+            context,
+        ):
+            files.add_page(boxes)
+    files.close()
+    return files, peak_rss()
+
+
+def draw_out_of_core(directory, output, first=1, last=None):
+    """Draw pages first to last (counting from 1) of a layout saved by
+    layout_out_of_core(). Only those pages are read."""
+    files = BoxFiles(directory).open()
+    if first > files.page_count:
+        raise ValueError('The text has less than %s pages' % first)
+    last = files.page_count if last is None else min(last, files.page_count)
+    wanted = [(i, files.page(i)) for i in range(first - 1, last)]
+    draw_pages(wanted, PageWindow(files.settings['page_size']), output)
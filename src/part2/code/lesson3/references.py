@@ -0,0 +1,171 @@
+"""A document with a table of contents and page references."""
+
+import re
+import time
+from bisect import bisect_right
+
+from document import Document
+
+# {#name} marks a place, {@name} is replaced by the page where it is
+MARK = re.compile(r'\{([#@])([^}]*)\}')
+
+
+class MarkedDocument(Document):
+    """A Document whose text has marks for page numbers.
+
+    * A line starting with '# ' is a heading, shown without the '# '.
+    * {#name} marks a place called name, and is not shown.
+    * {@name} is replaced by the number of the page where name is.
+    * A line that is just {toc} is replaced by a line for each
+      heading, with its page number.
+
+    Page numbers change the text, which can move things to other
+    pages, so we lay out again until they stop changing. Each time,
+    only the lines whose text changed are laid out again, as in
+    Document.edit(), and their hyphenation and shaping is reused for
+    all others. Lines are shaped with context, a fonts.FontContext.
+    """
+
+    def __init__(
+        self,
+        source,
+        page_size=(30, 50),
+        separation=0.05,
+        algorithm='greedy',
+        lookback=1,
+        max_iterations=10,
+        context=None,
+    ):
+        self.source = source
+        super().__init__(
+            ''.join(self._resolve({})),
+            page_size,
+            separation,
+            algorithm,
+            lookback,
+            context=context,
+        )
+        self.resolve(max_iterations)
+
+    def resolve(self, max_iterations=10):
+        """Lay out again until page numbers stop changing.
+
+        Sets and returns self.iterations, how many times page numbers
+        were checked, and self.seconds, how long it took.
+        self.converged is False if they were still changing after
+        max_iterations.
+        """
+        start = time.perf_counter()
+        self.converged = False
+        for self.iterations in range(1, max_iterations + 1):
+            old = [p.line for p in self.paragraphs]
+            new = self._resolve(self.label_pages())
+            changed = [k for k, line in enumerate(new) if line != old[k]]
+            if not changed:
+                self.converged = True
+                break
+            for k in changed:
+                start_k = self.offsets[k]
+                self.edit(start_k, start_k + len(old[k]), new[k])
+        self.seconds = time.perf_counter() - start
+        return self.iterations, self.seconds
+
+    def label_pages(self):
+        """The page where each label is, counting from 1."""
+        pages = {}
+        for name, (k, offset) in self.labels.items():
+            paragraph = self.paragraphs[k]
+            if paragraph.positions:
+                row = _row_at(paragraph, offset)
+                pages[name] = paragraph.positions[row][0] + 1
+        return pages
+
+    def _resolve(self, pages):
+        """The lines to lay out, with page numbers from pages.
+
+        Also sets self.labels, with the line where each label is, and
+        where in that line, as (line, offset).
+        """
+        source = self.source.splitlines(keepends=True)
+        headings = [
+            (MARK.sub('', line[2:]).strip(), 'heading-%s' % k)
+            for k, line in enumerate(source)
+            if line.startswith('# ')
+        ]
+        lines = []
+        self.labels = {}
+        # How much longer the line got, before the current match
+        shift = 0
+
+        def replace(match):
+            nonlocal shift
+            kind, name = match.groups()
+            if kind == '#':
+                self.labels[name] = len(lines), match.start() + shift
+                new = ''
+            else:
+                new = str(pages.get(name, '?'))
+            shift += len(new) - len(match.group())
+            return new
+
+        for k, line in enumerate(source):
+            text = line.rstrip('\r\n')
+            end = line[len(text) :]
+            if text.strip() == '{toc}':
+                for title, name in headings:
+                    lines.append(
+                        '%s ... %s\n' % (title, pages.get(name, '?'))
+                    )
+                continue
+            if text.startswith('# '):
+                self.labels['heading-%s' % k] = len(lines), 0
+                text = text[2:]
+            shift = 0
+            lines.append(MARK.sub(replace, text) + end)
+        if lines and not self.source.endswith(('\n', '\r')):
+            # The toc may have added a line break at the end
+            lines[-1] = lines[-1].rstrip('\r\n')
+        return lines
+
+
+def _row_at(paragraph, offset):
+    """The index of the row with the letter at offset in paragraph.line.
+
+    Hyphenating the line adds soft hyphens and leaves a single space
+    between words, so we find its box by counting the other letters.
+    """
+    letters = len(''.join(paragraph.line[:offset].split()))
+    i = 0
+    for i, box in enumerate(paragraph.boxes):
+        if box.letter not in (' ', '\xad', '\n'):
+            if letters == 0:
+                break
+            letters -= 1
+    starts = [row.start for row in paragraph.rows]
+    return max(bisect_right(starts, i) - 1, 0)
+
+
+def convert_marked(
+    input,
+    output,
+    page_size=(30, 50),
+    separation=0.05,
+    algorithm='greedy',
+    lookback=1,
+    context=None,
+):
+    """Like convert(), for a text with marks (see MarkedDocument).
+
+    Returns the document, to see how long page numbers took to settle.
+    """
+    with open(input) as f:
+        doc = MarkedDocument(
+            f.read(),
+            page_size,
+            separation,
+            algorithm,
+            lookback,
+            context=context,
+        )
+    doc.draw(output)
+    return doc
@@ -0,0 +1,173 @@
+"""An index of where each word is, written while laying out."""
+
+import mmap
+import re
+from collections import defaultdict
+
+import numpy as np
+
+# Where a word is: its page, where its 1st box is, and its boxes
+POSTING = np.dtype(
+    [
+        ('page', '<u4'),
+        ('x', '<f4'),
+        ('y', '<f4'),
+        ('start', '<u4'),
+        ('end', '<u4'),
+    ]
+)
+MAGIC = b'BXIX'
+# Words are what's between spaces and newlines
+WORD = re.compile('[^ \n]+')
+NOT_ALNUM = re.compile(r'[\W_]+')
+HEADER = np.dtype(
+    [
+        ('magic', 'S4'),
+        ('words', '<u4'),
+        ('postings', '<u4'),
+        ('text_size', '<u4'),
+    ]
+)
+
+
+def normalize(word):
+    """How words are looked up: lowercase, only letters and digits."""
+    return NOT_ALNUM.sub('', word.casefold())
+
+
+class IndexWriter():
+    """Collects the words in boxes, and where they are.
+
+    Pass it to layout(), which gives it each row as soon as it's laid
+    out, then save() it.
+    """
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.words = defaultdict(list)
+        # The word we are in the middle of, if a row ended inside it
+        self._letters = []
+        self._first = None
+        # Where the last row ended
+        self._end = 0
+
+    def add_row(self, start, end, page):
+        """Add boxes[start:end], laid out in page."""
+        boxes = self.boxes
+        text = ''.join([boxes[i].letter for i in range(start, end)])
+        if text[:1] in ('', ' ', '\n'):
+            # The word the last row ended with (if any) ended there
+            self._end_word(start)
+        for match in WORD.finditer(text):
+            a, b = match.span()
+            if not self._letters:
+                box = boxes[start + a]
+                self._first = (page, box.x, box.y, start + a)
+            self._letters.append(match.group())
+            if b < len(text):
+                self._end_word(start + b)
+        self._end = end
+
+    def _end_word(self, end):
+        if self._letters:
+            word = normalize(''.join(self._letters))
+            if word:
+                self.words[word].append(self._first + (end,))
+            self._letters = []
+
+    def save(self, fname):
+        """Write the index to a file, that SearchIndex can read.
+
+        The file has a header, then for each word (sorted) where its
+        text and its postings start, then all the text, and then all
+        the postings.
+        """
+        self._end_word(self._end)
+        words = sorted(self.words)
+        encoded = [w.encode('utf-8') for w in words]
+        text_offsets = np.zeros(len(words) + 1, '<u4')
+        np.cumsum([len(e) for e in encoded], out=text_offsets[1:])
+        posting_offsets = np.zeros(len(words) + 1, '<u4')
+        np.cumsum(
+            [len(self.words[w]) for w in words], out=posting_offsets[1:]
+        )
+        text = b''.join(encoded)
+        # Keep postings aligned
+        text += b'\0' * (-len(text) % 4)
+        postings = np.array(
+            [p for w in words for p in self.words[w]], POSTING
+        )
+        header = np.array(
+            [(MAGIC, len(words), len(postings), len(text))], HEADER
+        )
+        with open(fname, 'wb') as f:
+            for part in (header, text_offsets, posting_offsets):
+                f.write(part.tobytes())
+            f.write(text)
+            f.write(postings.tobytes())
+
+
+class SearchIndex():
+    """An index written by IndexWriter, memory-mapped.
+
+    Opening it reads nothing but the header, and finding a word looks
+    at a few of them, by bisection.
+    """
+
+    def __init__(self, fname):
+        with open(fname, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._map, HEADER, 1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError('Not a search index: %s' % fname)
+        self.size = n = int(header['words'])
+        offset = HEADER.itemsize
+        self._text_offsets = np.frombuffer(
+            self._map, '<u4', n + 1, offset
+        )
+        offset += 4 * (n + 1)
+        self._posting_offsets = np.frombuffer(
+            self._map, '<u4', n + 1, offset
+        )
+        offset += 4 * (n + 1)
+        self._text = offset
+        offset += int(header['text_size'])
+        self._postings = np.frombuffer(
+            self._map, POSTING, int(header['postings']), offset
+        )
+
+    def __len__(self):
+        return self.size
+
+    def word(self, k):
+        """The k-th word in the index, as bytes."""
+        start = self._text + self._text_offsets.item(k)
+        end = self._text + self._text_offsets.item(k + 1)
+        return self._map[start:end]
+
+    def find(self, word):
+        """Where word is, as a list of (page, x, y, start, end).
+
+        Pages are counted from 0, and boxes[start:end] are the boxes
+        of the word.
+        """
+        key = normalize(word).encode('utf-8')
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.word(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.size or self.word(low) != key:
+            return []
+        return self._postings[
+            self._posting_offsets.item(low) : self._posting_offsets.item(
+                low + 1
+            )
+        ].tolist()
+
+    def close(self):
+        # The arrays use the map, so they go first
+        self._text_offsets = self._posting_offsets = self._postings = None
+        self._map.close()
@@ -0,0 +1,140 @@
+"""Find laid out boxes by position, without looking at all of them."""
+
+from bisect import bisect_right
+from collections import defaultdict
+from math import floor
+
+# Boxes touching by less than this don't overlap, and boxes going out of
+# a page by less than this, on any side, are on it
+EPSILON = 1e-9
+
+
+class SpatialIndex():
+    """Laid out boxes, sorted into the cells of a grid.
+
+    The grid covers all pages, which are side by side, so each page
+    has its own cells. A box goes in every cell it touches, and boxes
+    are small, so that's usually one or two.
+
+    Building it takes time proportional to the number of boxes, and
+    finding boxes in an area only looks at the cells it covers.
+    """
+
+    def __init__(self, boxes, pages, cell=None):
+        self.boxes = boxes
+        self.pages = list(pages)
+        self._lefts = [p.x for p in self.pages]
+        if cell is None:
+            # Cells a bit bigger than a letter
+            cell = 2 * sum(b.h for b in boxes) / max(len(boxes), 1)
+        self.cell = cell or 1
+        self.cells = defaultdict(list)
+        for i, b in enumerate(boxes):
+            for key in self._keys(b.x, b.y, b.x + b.w, b.y + b.h):
+                self.cells[key].append(i)
+
+    def _keys(self, x0, y0, x1, y1):
+        """The cells touched by a rectangle."""
+        cell = self.cell
+        for cx in range(floor(x0 / cell), floor(x1 / cell) + 1):
+            for cy in range(floor(y0 / cell), floor(y1 / cell) + 1):
+                yield cx, cy
+
+    def query(self, x0, y0, x1, y1):
+        """Indexes of the boxes that touch a rectangle, sorted."""
+        found = set()
+        boxes = self.boxes
+        for key in self._keys(x0, y0, x1, y1):
+            for i in self.cells.get(key, ()):
+                b = boxes[i]
+                if (
+                    b.x <= x1
+                    and b.x + b.w >= x0
+                    and b.y <= y1
+                    and b.y + b.h >= y0
+                ):
+                    found.add(i)
+        return sorted(found)
+
+    def at(self, x, y):
+        """Indexes of the boxes at a point, sorted."""
+        return self.query(x, y, x, y)
+
+    def page_at(self, x, y):
+        """The index of the page at a point, or None.
+
+        Points just outside a page, by rounding, are on it.
+        """
+        k = bisect_right(self._lefts, x + EPSILON) - 1
+        if k < 0:
+            return None
+        p = self.pages[k]
+        if (
+            x <= p.x + p.w + EPSILON
+            and p.y - EPSILON <= y <= p.y + p.h + EPSILON
+        ):
+            return k
+        return None
+
+    def overlaps(self):
+        """All pairs (i, j) of boxes that overlap, with i < j.
+
+        Each pair is only checked in cells where both are, and only
+        reported by the cell where their overlap starts.
+        """
+        boxes = self.boxes
+        cell = self.cell
+        pairs = []
+        for (cx, cy), indexes in self.cells.items():
+            for a, i in enumerate(indexes):
+                bi = boxes[i]
+                for j in indexes[a + 1 :]:
+                    bj = boxes[j]
+                    x0 = max(bi.x, bj.x)
+                    y0 = max(bi.y, bj.y)
+                    if (
+                        min(bi.x + bi.w, bj.x + bj.w) - x0 > EPSILON
+                        and min(bi.y + bi.h, bj.y + bj.h) - y0 > EPSILON
+                        and floor(x0 / cell) == cx
+                        and floor(y0 / cell) == cy
+                    ):
+                        pairs.append((min(i, j), max(i, j)))
+        return sorted(pairs)
+
+    def off_page(self):
+        """Indexes of the boxes that are not all inside a page."""
+        outside = []
+        for i, b in enumerate(self.boxes):
+            k = self.page_at(b.x, b.y)
+            if k is None:
+                outside.append(i)
+                continue
+            p = self.pages[k]
+            if (
+                b.x + b.w > p.x + p.w + EPSILON
+                or b.y + b.h > p.y + p.h + EPSILON
+            ):
+                outside.append(i)
+        return outside
+
+
+def validate(boxes, pages):
+    """Check a layout: boxes should not overlap, or be off pages.
+
+    Returns a report, as a dict.
+    """
+    index = SpatialIndex(boxes, pages)
+    overlaps = index.overlaps()
+    off_page = index.off_page()
+    return {
+        'boxes': len(boxes),
+        'pages': len(index.pages),
+        'overlaps': len(overlaps),
+        'off_page': len(off_page),
+        'examples': {
+            'overlaps': [
+                [repr(boxes[i]), repr(boxes[j])] for i, j in overlaps[:5]
+            ],
+            'off_page': [repr(boxes[i]) for i in off_page[:5]],
+        },
+    }
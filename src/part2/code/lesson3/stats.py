@@ -0,0 +1,80 @@
+"""Count pages and rows, without drawing anything."""
+
+import numpy as np
+
+from boxarray import STRETCHY
+from boxes import create_pages, create_text_boxes
+from numpy_layout import break_arrays
+
+
+def layout_stats(
+    boxes, page_size=(30, 50), separation=0.05, tolerance=1, context=None
+):
+    """Break a BoxArray into rows and pages, and count them.
+
+    Boxes are not modified or placed, only the rows are measured (see
+    break_arrays), so the same boxes can be counted for many page
+    sizes. Rows are broken like layout() breaks them by default.
+
+    A row is overfull if it's drawn past the right margin: its boxes
+    don't fit in it, and it's not justified, or squeezing its stretchy
+    boxes to nothing isn't enough. It's underfull if it's justified and
+    its stretchy boxes have to grow more than tolerance times their
+    width (or it has nothing to stretch).
+
+    Hyphens are as wide as context, a fonts.FontContext, says.
+
+    Returns a dict.
+    """
+    n = len(boxes)
+    if n == 0:
+        return dict.fromkeys(
+            (
+                'pages',
+                'rows',
+                'paragraphs',
+                'overfull',
+                'underfull',
+                'hyphens',
+            ),
+            0,
+        )
+    rows = break_arrays(
+        boxes, create_pages(page_size), separation, context
+    )
+    # Total width of the stretchy boxes in each row
+    stretchy = (boxes.flags[:n] & STRETCHY) > 0
+    stretchy &= boxes.codepoints[:n] != ord('\n')
+    stretch = np.zeros(n + 1)
+    np.cumsum(np.where(stretchy, boxes.w[:n], 0), out=stretch[1:])
+    anchor = np.maximum(rows.first, rows.start)
+    stretch = stretch[rows.last + 1] - stretch[anchor]
+    # Justifying a row can squeeze its stretchy boxes to nothing (with
+    # the same leeway for rounding as layout())
+    squeezable = np.where(rows.full, stretch, 0) + 1e-6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        underfull = rows.full & (
+            (stretch <= 0) & (rows.slack > 0)
+            | (rows.slack > tolerance * stretch)
+        )
+    return {
+        'pages': rows.pages(),
+        'rows': len(rows),
+        'paragraphs': int((boxes.codepoints[:n] == ord('\n')).sum()) + 1,
+        'overfull': int((rows.slack < -squeezable).sum()),
+        'underfull': int(underfull.sum()),
+        'hyphens': int(rows.hyphen.sum()),
+    }
+
+
+def file_stats(
+    input, page_size=(30, 50), separation=0.05, tolerance=1, context=None
+):
+    """layout_stats() for the text in a file, shaped with context."""
+    return layout_stats(
+        create_text_boxes(input, True, context),
+        page_size,
+        separation,
+        tolerance,
+        context,
+    )
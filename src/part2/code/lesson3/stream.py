@@ -0,0 +1,276 @@
+"""Lay out a text a page at a time, stopping when we have enough."""
+
+import json
+import os
+
+from boxes import Box, create_pages, draw_boxes
+from document import Paragraph
+
+
+def iter_rows(
+    lines,
+    pages,
+    separation=0.05,
+    algorithm='greedy',
+    lookback=1,
+    context=None,
+):
+    """Lay out lines of text on pages, yielding each row when placed.
+
+    Each line is hyphenated, shaped and broken into rows only when the
+    rows before it have been used, so stopping early saves all the
+    work for the rest of the text.
+
+    Like layout(..., jobs=...), all pages must be the same width.
+    Lines are shaped with context, a fonts.FontContext.
+
+    Yields (page, boxes) for each row: the index of its page, and
+    its boxes, including its hyphen if it has one.
+    """
+    after = None
+    for k, line in enumerate(lines):
+        paragraph = Paragraph(line, k > 0, context=context)
+        paragraph.break_rows(pages[0].w, separation, algorithm, lookback)
+        after = paragraph.place(pages, separation, after)
+        for row, (page, y) in zip(paragraph.rows, paragraph.positions):
+            boxes = paragraph.boxes[row.start : row.end]
+            if row.hyphen:
+                boxes.append(row.hyphen)
+            yield page, boxes
+
+
+def iter_pages(
+    lines,
+    pages,
+    separation=0.05,
+    algorithm='greedy',
+    lookback=1,
+    context=None,
+):
+    """Like iter_rows(), but yields (page, boxes) for each page.
+
+    A page is yielded as soon as a row doesn't fit in it.
+    """
+    return _group_pages(
+        iter_rows(lines, pages, separation, algorithm, lookback, context)
+    )
+
+
+def _group_pages(rows):
+    """Turn (page, boxes) for each row into (page, boxes) for each page."""
+    current, page_boxes = None, []
+    for page, boxes in rows:
+        if page != current:
+            if page_boxes:
+                yield current, page_boxes
+            current, page_boxes = page, []
+        page_boxes.extend(boxes)
+    if page_boxes:
+        yield current, page_boxes
+
+
+class Book():
+    """A text file laid out a page at a time, remembering where pages
+    start, so any pages can be laid out again without the ones before.
+
+    For each page, we keep a checkpoint: where the line with its first
+    row starts in the file, the line's number, and where the row
+    before that line was put. Lines are always broken into rows the
+    same way, so that's all we need to lay them out again from there.
+    Rows and hyphens don't carry over between lines, so there is no
+    other state to keep.
+    """
+
+    def __init__(
+        self,
+        input,
+        page_size=(30, 50),
+        separation=0.05,
+        algorithm='greedy',
+        lookback=1,
+        context=None,
+    ):
+        self.input = input
+        self.page_size = tuple(page_size)
+        self.separation = separation
+        self.algorithm = algorithm
+        self.lookback = lookback
+        self.context = context
+        self.pages = create_pages(page_size)
+        # (line, offset, after) by page, counting from 0
+        self.checkpoints = {0: (0, 0, None)}
+
+    def iter_rows(self, first=0):
+        """Like iter_rows(), starting at the first row on page first.
+
+        Pages are counted from 0.
+        """
+        page = max(p for p in self.checkpoints if p <= first)
+        line, offset, after = self.checkpoints[page]
+        with open(self.input) as f:
+            f.seek(offset)
+            while True:
+                offset = f.tell()
+                text = f.readline()
+                if not text:
+                    return
+                before = after
+                paragraph = Paragraph(text, line > 0, context=self.context)
+                paragraph.break_rows(
+                    self.pages[0].w,
+                    self.separation,
+                    self.algorithm,
+                    self.lookback,
+                )
+                after = paragraph.place(self.pages, self.separation, after)
+                for row, (page, y) in zip(
+                    paragraph.rows, paragraph.positions
+                ):
+                    if page not in self.checkpoints:
+                        self.checkpoints[page] = (line, offset, before)
+                    if page < first:
+                        continue
+                    boxes = paragraph.boxes[row.start : row.end]
+                    if row.hyphen:
+                        boxes.append(row.hyphen)
+                    yield page, boxes
+                line += 1
+
+    def iter_pages(self, first=0):
+        """Like iter_pages(), starting at page first."""
+        return _group_pages(self.iter_rows(first))
+
+    def _settings(self):
+        """What the checkpoints depend on."""
+        stat = os.stat(self.input)
+        return [
+            list(self.page_size),
+            self.separation,
+            self.algorithm,
+            self.lookback,
+            stat.st_size,
+            stat.st_mtime,
+        ]
+
+    def save(self, fname):
+        """Save the checkpoints to a file."""
+        with open(fname, 'w') as f:
+            json.dump(
+                {
+                    'settings': self._settings(),
+                    'checkpoints': sorted(self.checkpoints.items()),
+                },
+                f,
+            )
+
+    def load(self, fname):
+        """Load checkpoints saved by save(), if they are for this text
+        and these settings. Returns True if they were loaded."""
+        with open(fname) as f:
+            saved = json.load(f)
+        if saved['settings'] != self._settings():
+            return False
+        for page, (line, offset, after) in saved['checkpoints']:
+            self.checkpoints[page] = (
+                line,
+                offset,
+                tuple(after) if after else None,
+            )
+        return True
+
+
+def render_pages(book, first, last, fname):
+    """Draw pages first to last (counting from 1) of a Book.
+
+    Layout starts from the closest checkpoint, so this takes about the
+    same time for any pages, once the book has checkpoints for them.
+
+    Returns the boxes and pages drawn (see draw_pages).
+    """
+    wanted = []
+    for page, boxes in book.iter_pages(first - 1):
+        wanted.append((page, boxes))
+        if last is not None and page + 1 >= last:
+            break
+    if not wanted:
+        raise ValueError('The text has less than %s pages' % first)
+    return draw_pages(wanted, book.pages, fname)
+
+
+def convert_pages(
+    input,
+    output,
+    page_size=(30, 50),
+    separation=0.05,
+    first=1,
+    last=None,
+    algorithm='greedy',
+    lookback=1,
+    checkpoints=None,
+    context=None,
+):
+    """Like convert(), but only draws pages first to last.
+
+    Pages are numbered from 1, and last=None means all the rest.
+    Layout stops once the last page is done.
+
+    If checkpoints is a file name, checkpoints are loaded from it
+    (if it exists and matches) and saved to it afterwards.
+
+    Text is shaped with context, a fonts.FontContext.
+
+    Returns the boxes and pages drawn (see draw_pages).
+    """
+    book = Book(
+        input, page_size, separation, algorithm, lookback, context
+    )
+    if checkpoints and os.path.exists(checkpoints):
+        book.load(checkpoints)
+    drawn = render_pages(book, first, last, output)
+    if checkpoints:
+        book.save(checkpoints)
+    return drawn
+
+
+def draw_pages(wanted, pages, fname):
+    """Draw some pages, given as (page, boxes), side by side.
+
+    Returns the boxes and pages, as drawn.
+    """
+    # Move everything left, so the first page we draw is at the edge
+    dx = pages[wanted[0][0]].x
+    moved_pages = []
+    moved_boxes = []
+    for page, boxes in wanted:
+        p = pages[page]
+        moved_pages.append(Box(p.x - dx, p.y, p.w, p.h))
+        moved_boxes.extend(
+            Box(b.x - dx, b.y, b.w, b.h, b.stretchy, b.letter)
+            for b in boxes
+        )
+    draw_boxes(
+        moved_boxes,
+        moved_pages,
+        fname,
+        (
+            moved_pages[-1].w + moved_pages[-1].x,
+            max(p.h for p in moved_pages),
+        ),
+        True,
+    )
+    return moved_boxes, moved_pages
+
+
+def parse_page_range(pages=None, max_pages=None):
+    """Turn --pages and --max-pages into (first, last), from 1.
+
+    pages looks like '3-5', '3' or '3-'.
+    """
+    first, last = 1, None
+    if pages:
+        start, _, end = pages.partition('-')
+        first = int(start) if start else 1
+        last = (int(end) if end else None) if _ else first
+    if max_pages:
+        last = min(int(max_pages), last or int(max_pages))
+    return first, last
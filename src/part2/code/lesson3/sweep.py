@@ -0,0 +1,94 @@
+"""Lay out the same text with many page sizes and separations."""
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from boxarray import BoxArray
+from boxes import create_pages
+from fonts import advances, preload
+from hyphen import insert_soft_hyphens
+from numpy_layout import break_arrays
+
+
+def shape_text(text, context=None):
+    """Hyphenate and shape text once, into read-only boxes.
+
+    The boxes can't be modified, so they can be laid out as many
+    times as needed with break_arrays().
+    """
+    text = insert_soft_hyphens(text)
+    boxes = BoxArray.from_advances(text, advances(text, context))
+    for array in (boxes.x, boxes.y, boxes.w, boxes.h):
+        array.flags.writeable = False
+    boxes.flags.flags.writeable = False
+    boxes.codepoints.flags.writeable = False
+    return boxes
+
+
+def sweep(
+    text,
+    page_sizes=((30, 50),),
+    separations=(0.05,),
+    jobs=1,
+    context=None,
+):
+    """Lay out text with every page size and separation given.
+
+    The text is hyphenated and shaped only once, with context (a
+    fonts.FontContext). Each layout is done by break_arrays(), using
+    jobs processes (as many as there are CPUs if jobs is None).
+
+    Returns a dict of RowTable, by (page_size, separation). Use their
+    laid_out() method to get boxes to draw, on the pages from
+    create_pages(page_size).
+    """
+    boxes = shape_text(text, context)
+    # Sizes are keys in the results, so they can't be lists
+    page_sizes = [tuple(page_size) for page_size in page_sizes]
+    combinations = list(product(page_sizes, separations))
+    if jobs == 1:
+        return {
+            (page_size, separation): break_arrays(
+                boxes, create_pages(page_size), separation, context
+            )
+            for page_size, separation in combinations
+        }
+
+    results = {}
+    # Running totals over the boxes, by separation
+    totals = {}
+    # Each process gets the boxes and loads the font once, not once per
+    # layout
+    with ProcessPoolExecutor(
+        jobs, initializer=_set_boxes, initargs=(boxes, context)
+    ) as pool:
+        for combination, rows in zip(
+            combinations, pool.map(_sweep_job, combinations)
+        ):
+            # We got the rows without boxes, so we give them ours
+            separation = combination[1]
+            totals[separation] = rows.attach(
+                boxes, totals.get(separation)
+            )
+            results[combination] = rows
+    return results
+
+
+# The boxes each process lays out, set when it starts
+_boxes = None
+
+
+def _set_boxes(boxes, context=None):
+    global _boxes
+    _boxes = boxes
+    preload(context)
+
+
+def _sweep_job(combination):
+    """Lay out _boxes in another process, and send back the rows."""
+    page_size, separation = combination
+    rows = break_arrays(_boxes, create_pages(page_size), separation)
+    # No need to send the boxes back, or anything with an item for
+    # each box
+    rows.detach()
+    return rows